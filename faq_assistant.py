@@ -10,6 +10,88 @@ from typing import List, Dict, Any, Optional, Tuple
 from rag_system import RAGSystem
 from citation_handler import CitationHandler
 
+# "<number>. <category>" lines of a batched classification response
+_NUMBERED_CATEGORY_RE = re.compile(r'\s*(\d+)[.):]\s*"?([a-z_]+)')
+
+# Rule-based classifier patterns, each list joined into one alternation compiled once
+# (queries are lowercased first, as before)
+_GREETING_PATTERNS = [
+    r'^(hi|hello|hey|greetings|good morning|good afternoon|good evening|good night)',
+    r'^(hi|hello|hey)\s+there',
+    r'^(hi|hello|hey)\s*[!.]*$',
+    r'^howdy',
+    r'^what\'?s up',
+    r'^sup'
+]
+_GREETING_RE = re.compile("|".join(f"(?:{pattern})" for pattern in _GREETING_PATTERNS))
+_ADVICE_KEYWORDS = [
+    'should i', 'should i buy', 'should i invest', 'should i sell',
+    'is it good', 'is it bad', 'is it worth', 'is it safe',
+    'recommend', 'recommendation', 'suggest', 'suggestion',
+    'better', 'best', 'worst', 'good for me', 'suitable for me',
+    'compare returns', 'which is better', 'which fund',
+    'should i choose', 'advice', 'opinion', 'think'
+]
+_ADVICE_RE = re.compile("|".join(re.escape(keyword) for keyword in _ADVICE_KEYWORDS))
+_COVERAGE_PATTERNS = [
+    r'what (funds|schemes|mutual funds).*(do you|can you).*(have|cover|support|offer)',
+    r'which (funds|schemes|mutual funds).*(do you|can you).*(have|cover|support|offer)',
+    r'(what|which) (funds|schemes).*(available|covered)',
+    r'list.*(funds|schemes)',
+    r'show.*(funds|schemes)',
+    r'tell me.*(funds|schemes).*(you|we) (have|cover)',
+    r'(funds|schemes).*(you|we) (have|cover|support)',
+    r'coverage',
+    r'what.*schemes.*do.*have',
+    r'which.*schemes.*available',
+    r'what (all )?can i ask (you|about)',
+    r'what (all )?(questions|topics|things) can i ask',
+    r'what can you (help|answer|tell)',
+    r'what (do|can) you (know|answer|help)',
+    r'what are your capabilities',
+    r'what (topics|questions) (do you|can you) (answer|handle|cover)',
+    r'tell me what you can do',
+    r'what information (do you|can you) provide'
+]
+_COVERAGE_RE = re.compile("|".join(f"(?:{pattern})" for pattern in _COVERAGE_PATTERNS))
+# Out-of-context phrases for the LLM-free paths of the test harnesses (test_patterns, test_queries
+# --fast-mode); production relevance is decided by is_mutual_fund_related
+OUT_OF_CONTEXT_PATTERNS = [
+    r'\bpm\b', r'prime minister', r'president', r'minister',
+    r'capital of', r'capital city',
+    r'favorite sport', r'favourite sport',
+    r'tell me a joke', r'joke',
+    r'weather', r'temperature',
+    r'what is your name', r'who are you',
+    r'what time is it', r'what day is it',
+    r'how are you', r'how do you do',
+    r'who is (the )?(pm|president|ceo|founder|director)',
+    r'what is (the )?(population|area|size)',
+    r'when (is|was|will)',
+    r'where (is|was|are)',
+    r'\b(do you|can you|did you)\s+(cook|eat|sleep|dance|sing|play|run|walk)',
+    r'\b(cooking|baking|chef|kitchen|meal|breakfast|lunch|dinner)\b',
+    r'(cricket|football|sports|movie|film|music)',
+    r'(recipe|food|restaurant)',
+    r'(technology|computer|phone|laptop)(?! fund)',
+    r'(game|gaming|video)',
+    r'(travel|tourism|hotel|flight)'
+]
+OUT_OF_CONTEXT_RE = re.compile("|".join(f"(?:{pattern})" for pattern in OUT_OF_CONTEXT_PATTERNS), re.IGNORECASE)
+
+# Category list and rules shared by the single and batched classification prompts
+_CLASSIFICATION_CATEGORIES = """Categories:
+1. greeting - User is saying hi, hello, or greeting
+2. coverage - User asking what funds/schemes/questions you cover or your capabilities
+3. factual - User wants factual information about MUTUAL FUNDS ONLY (expense ratio, SIP, exit load, lock-in, benchmark, etc.)
+4. advice - User seeking investment advice or recommendations (should I invest, which is better, etc.)
+5. out_of_context - Completely unrelated to mutual funds (politics, sports, jokes, cooking, personal questions, random text, etc.)
+
+IMPORTANT: 
+- If the query has NOTHING to do with mutual funds or investments, classify as "out_of_context"
+- Examples of out_of_context: "do you cook", "what's the weather", "tell me a joke", "who is PM"
+- Only classify as "factual" if it's clearly about mutual fund information"""
+
 class FAQAssistant:
     def __init__(self, model_type: str = None, model_name: str = None, api_key: Optional[str] = None):
         """
@@ -80,6 +162,13 @@ class FAQAssistant:
                     self.model = genai.GenerativeModel('gemini-pro-latest')
                 self.HarmCategory = HarmCategory
                 self.HarmBlockThreshold = HarmBlockThreshold
+                # Safety settings are constant, so build them once instead of per call
+                self.safety_settings = {
+                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+                }
                 print(f"✓ Using Gemini with model: {self.model_name or 'gemini-2.0-flash'}")
             except ImportError:
                 raise ValueError("Google Generative AI not installed. Install with: pip install google-generativeai")
@@ -158,7 +247,6 @@ class FAQAssistant:
                     raise e
         
         elif self.model_type == "gemini":
-            from google.generativeai.types import HarmCategory, HarmBlockThreshold
             full_prompt = prompt
             if system_prompt:
                 full_prompt = f"{system_prompt}\n\n{prompt}"
@@ -169,12 +257,7 @@ class FAQAssistant:
                     "temperature": temperature,
                     "max_output_tokens": max_tokens,
                 },
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
+                safety_settings=self.safety_settings
             )
             if response.candidates and response.candidates[0].finish_reason == 1:
                 return response.text.strip()
@@ -217,67 +300,31 @@ class FAQAssistant:
     def is_greeting(self, query: str) -> bool:
         """Detect greetings using keywords and patterns"""
         query_lower = query.lower().strip()
-        greeting_patterns = [
-            r'^(hi|hello|hey|greetings|good morning|good afternoon|good evening|good night)',
-            r'^(hi|hello|hey)\s+there',
-            r'^(hi|hello|hey)\s*[!.]*$',
-            r'^howdy',
-            r'^what\'?s up',
-            r'^sup'
-        ]
-        
-        for pattern in greeting_patterns:
-            if re.match(pattern, query_lower):
-                return True
-        
-        return False
+        return bool(_GREETING_RE.match(query_lower))
     
     def is_advice_query(self, query: str) -> bool:
         """Detect advice-seeking queries"""
         query_lower = query.lower()
-        advice_keywords = [
-            'should i', 'should i buy', 'should i invest', 'should i sell',
-            'is it good', 'is it bad', 'is it worth', 'is it safe',
-            'recommend', 'recommendation', 'suggest', 'suggestion',
-            'better', 'best', 'worst', 'good for me', 'suitable for me',
-            'compare returns', 'which is better', 'which fund',
-            'should i choose', 'advice', 'opinion', 'think'
-        ]
-        
-        for keyword in advice_keywords:
-            if keyword in query_lower:
-                return True
-        
-        return False
+        return bool(_ADVICE_RE.search(query_lower))
     
     def is_coverage_query(self, query: str) -> bool:
         """Detect queries asking about what funds/schemes we cover"""
         query_lower = query.lower()
-        coverage_patterns = [
-            r'what (funds|schemes|mutual funds).*(do you|can you).*(have|cover|support|offer)',
-            r'which (funds|schemes|mutual funds).*(do you|can you).*(have|cover|support|offer)',
-            r'(what|which) (funds|schemes).*(available|covered)',
-            r'list.*(funds|schemes)',
-            r'show.*(funds|schemes)',
-            r'tell me.*(funds|schemes).*(you|we) (have|cover)',
-            r'(funds|schemes).*(you|we) (have|cover|support)',
-            r'coverage',
-            r'what.*schemes.*do.*have',
-            r'which.*schemes.*available',
-            r'what (all )?can i ask (you|about)',
-            r'what (all )?(questions|topics|things) can i ask',
-            r'what can you (help|answer|tell)',
-            r'what (do|can) you (know|answer|help)',
-            r'what are your capabilities',
-            r'what (topics|questions) (do you|can you) (answer|handle|cover)',
-            r'tell me what you can do',
-            r'what information (do you|can you) provide'
-        ]
+        return bool(_COVERAGE_RE.search(query_lower))
+    
+    @staticmethod
+    def _quick_relevance(query_lower: str) -> Optional[bool]:
+        """Relevance of obvious gibberish/short queries without an LLM; None if it needs the LLM"""
+        if query_lower.isdigit():
+            return False
         
-        for pattern in coverage_patterns:
-            if re.search(pattern, query_lower):
-                return True
-        return False
+        if len(query_lower) <= 2:
+            mf_short_terms = ['mf', 'nav', 'aum', 'sip']
+            return query_lower in mf_short_terms
+        
+        if len(query_lower) <= 3 and not any(c.isalpha() for c in query_lower):
+            return False
+        return None
     
     def is_mutual_fund_related(self, query: str) -> bool:
         """
@@ -289,15 +336,9 @@ class FAQAssistant:
         query_lower = query.lower().strip()
         
         # Fast checks for obvious gibberish (no LLM needed)
-        if query_lower.isdigit():
-            return False
-        
-        if len(query_lower) <= 2:
-            mf_short_terms = ['mf', 'nav', 'aum', 'sip']
-            return query_lower in mf_short_terms
-        
-        if len(query_lower) <= 3 and not any(c.isalpha() for c in query_lower):
-            return False
+        quick = self._quick_relevance(query_lower)
+        if quick is not None:
+            return quick
         
         # Use LLM for relevance check
         relevance_prompt = f"""Is this query related to mutual funds, investments, or financial products?
@@ -372,17 +413,7 @@ Answer:"""
 
 Query: "{query}"
 
-Categories:
-1. greeting - User is saying hi, hello, or greeting
-2. coverage - User asking what funds/schemes/questions you cover or your capabilities
-3. factual - User wants factual information about MUTUAL FUNDS ONLY (expense ratio, SIP, exit load, lock-in, benchmark, etc.)
-4. advice - User seeking investment advice or recommendations (should I invest, which is better, etc.)
-5. out_of_context - Completely unrelated to mutual funds (politics, sports, jokes, cooking, personal questions, random text, etc.)
-
-IMPORTANT: 
-- If the query has NOTHING to do with mutual funds or investments, classify as "out_of_context"
-- Examples of out_of_context: "do you cook", "what's the weather", "tell me a joke", "who is PM"
-- Only classify as "factual" if it's clearly about mutual fund information
+{_CLASSIFICATION_CATEGORIES}
 
 Return ONLY the category name (one word), nothing else.
 
@@ -404,14 +435,46 @@ Category:"""
             print(f"LLM classification failed: {e}, falling back to rule-based")
             return None  # Signal to use rule-based classification
     
-    def classify_query_type(self, query: str) -> str:
-        """Classify query type: greeting, coverage, out_of_context, advice, or factual
+    def llm_classify_queries(self, queries: List[str]) -> List[Optional[str]]:
+        """Classify several ambiguous queries with one LLM call (numbered prompt, numbered answers)
         
-        Uses hybrid approach:
-        1. First try rule-based classification (fast, predictable)
-        2. If uncertain AND LLM classification enabled, use LLM (better understanding)
+        Returns one category per query ('factual' for unparseable lines), or all None if the call fails.
         """
-        # Quick rule-based checks first (no LLM cost)
+        if len(queries) == 1:
+            return [self.llm_classify_query(queries[0])]
+        
+        numbered = "\n".join(f'{i}. "{query}"' for i, query in enumerate(queries, 1))
+        classification_prompt = f"""Classify each user query below into ONE category:
+
+Queries:
+{numbered}
+
+{_CLASSIFICATION_CATEGORIES}
+
+Return one line per query in the same order, formatted as "<number>. <category name>", nothing else.
+
+Categories:"""
+        
+        try:
+            system_prompt = "You are a query classifier. Return only the numbered category names."
+            response = self._call_llm(classification_prompt, max_tokens=20 * len(queries), temperature=0.1,
+                                      system_prompt=system_prompt)
+        except Exception as e:
+            print(f"LLM classification failed: {e}, falling back to rule-based")
+            return [None] * len(queries)
+        
+        # Anything missing or not a valid category falls back to 'factual', as for a single query
+        valid_types = ['greeting', 'coverage', 'factual', 'advice', 'out_of_context']
+        classifications = ['factual'] * len(queries)
+        for line in response.splitlines():
+            match = _NUMBERED_CATEGORY_RE.match(line.strip().lower())
+            if match and 1 <= int(match.group(1)) <= len(queries) and match.group(2) in valid_types:
+                classifications[int(match.group(1)) - 1] = match.group(2)
+        return classifications
+    
+    def _rule_based_query_type(self, query: str) -> Optional[str]:
+        """Rule-based checks; None means the query looks factual
+        (the out-of-context check makes one LLM relevance call unless the query is obvious gibberish)"""
         if self.is_greeting(query):
             return 'greeting'
         elif self.is_coverage_query(query):
@@ -420,16 +483,31 @@ Category:"""
             return 'advice'
         elif self.is_out_of_context(query):
             return 'out_of_context'
-        
-        # For potential factual queries, optionally use LLM to double-check
-        # This catches edge cases that rules might miss
+        return None
+    
+    @staticmethod
+    def _use_llm_classification() -> bool:
         try:
             from config import Config
-            use_llm_classification = Config.USE_LLM_CLASSIFICATION
+            return Config.USE_LLM_CLASSIFICATION
         except:
-            use_llm_classification = True  # Default to enabled
+            return True  # Default to enabled
+    
+    def classify_query_type(self, query: str) -> str:
+        """Classify query type: greeting, coverage, out_of_context, advice, or factual
+        
+        Uses hybrid approach:
+        1. First try rule-based classification (fast, predictable)
+        2. If uncertain AND LLM classification enabled, use LLM (better understanding)
+        """
+        # Quick rule-based checks first (no LLM cost)
+        rule_type = self._rule_based_query_type(query)
+        if rule_type:
+            return rule_type
         
-        if use_llm_classification:
+        # For potential factual queries, optionally use LLM to double-check
+        # This catches edge cases that rules might miss
+        if self._use_llm_classification():
             llm_classification = self.llm_classify_query(query)
             if llm_classification:
                 return llm_classification
@@ -437,6 +515,39 @@ Category:"""
         # Default to factual if LLM classification disabled or fails
         return 'factual'
     
+    def _regex_query_type(self, query: str) -> Optional[str]:
+        """The rule-based checks that need no LLM: greeting, coverage, advice, obvious gibberish"""
+        if self.is_greeting(query):
+            return 'greeting'
+        elif self.is_coverage_query(query):
+            return 'coverage'
+        elif self.is_advice_query(query):
+            return 'advice'
+        elif self._quick_relevance(query.lower().strip()) is False:
+            return 'out_of_context'
+        return None
+    
+    def classify_query_types(self, queries: List[str]) -> List[str]:
+        """classify_query_type for a list of queries, with one LLM call for all the uncertain ones
+        
+        The per-query LLM relevance check (is_out_of_context) is skipped here - the batched
+        classification prompt decides out_of_context itself.
+        """
+        if not self._use_llm_classification():
+            return [self.classify_query_type(query) for query in queries]
+        
+        results = [self._regex_query_type(query) for query in queries]
+        pending = [i for i, result in enumerate(results) if result is None]
+        
+        if pending:
+            llm_classifications = self.llm_classify_queries([queries[i] for i in pending])
+            for i, llm_classification in zip(pending, llm_classifications):
+                # LLM call failed - fall back to the per-query rule-based path
+                results[i] = llm_classification or self._rule_based_query_type(queries[i])
+        
+        # Default to factual if the rules settle nothing
+        return [result or 'factual' for result in results]
+    
     def handle_greeting(self) -> str:
         """Generate greeting response"""
         return """Hello! 👋 I'm a facts-only mutual fund assistant.
@@ -839,7 +950,7 @@ We cover:
             return clarification_msg, None
         
         # Ensure vector store is initialized
-        if not self.rag_system.collection:
+        if not self.rag_system.collection and not self.rag_system.load_existing():
             try:
                 # Try to create vector store automatically
                 self.rag_system.create_vector_store(force_recreate=False)
@@ -917,7 +1028,22 @@ We cover:
             chat_history = []
         
         query_type = self.classify_query_type(query)
+        return self._answer_query(query, query_type, chat_history)
+    
+    def process_queries(self, queries: List[str]) -> List[Tuple[str, Optional[str]]]:
+        """process_query for several first-turn queries, in order
         
+        One LLM call classifies all the queries the regex rules can't settle (see
+        classify_query_types); greeting/coverage/advice/out-of-context answers are canned and make
+        no further call. Factual queries still run one at a time - each needs its own retrieval
+        context, refinement and answer calls.
+        """
+        query_types = self.classify_query_types(queries)
+        return [self._answer_query(query, query_type, []) for query, query_type in zip(queries, query_types)]
+    
+    def _answer_query(self, query: str, query_type: str,
+                      chat_history: List[Dict[str, str]]) -> Tuple[str, Optional[str]]:
+        """Route a classified query to its handler"""
         if query_type == 'greeting':
             return self.handle_greeting(), None
         elif query_type == 'coverage':
@@ -4,66 +4,349 @@ RAG System Setup
 Loads knowledge base, creates document chunks, generates embeddings, and builds vector store
 """
 
+import asyncio
+import hashlib
 import json
 import os
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Any
+import numpy as np
 from sentence_transformers import SentenceTransformer
 import chromadb
 from chromadb.config import Settings
 import re
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+
+def _resolve_device() -> str:
+    """Use the GPU for embeddings when one is available"""
+    try:
+        import torch
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    except ImportError:
+        return 'cpu'
+
+# HNSW index settings for the collection (only applied when it is created).
+# Embeddings are normalized, so cosine ranks the same as L2; M/ef are sized for a
+# KB of a few thousand chunks.
+HNSW_PARAMS = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:search_ef": 64
+}
+# Stored in the collection metadata and compared on load. Chroma isn't guaranteed to echo the
+# hnsw:* keys back in collection.metadata (newer versions keep them in the configuration).
+INDEX_PARAMS_TAG = "{}/M{}/ef{}/{}".format(HNSW_PARAMS["hnsw:space"], HNSW_PARAMS["hnsw:M"],
+                                           HNSW_PARAMS["hnsw:construction_ef"], HNSW_PARAMS["hnsw:search_ef"])
+
+# Token cap for the encoder (MiniLM default is 256). An 800-char chunk is ~150-200
+# tokens, so this mostly trims padding rather than content.
+MAX_SEQ_LENGTH = 192
+
+# Candidate chunk break points (sentence endings and newlines)
+_BOUNDARY_RE = re.compile(r'[.\n]')
+
+def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
+    """Split content into chunks with overlap (module level so worker processes can pickle it)"""
+    if not text or len(text.strip()) < chunk_size:
+        return [text] if text else []
+    
+    chunks = []
+    start = 0
+    text_length = len(text)
+    # Every sentence ending / newline position, found in one pass
+    boundaries = [m.start() for m in _BOUNDARY_RE.finditer(text)]
+    
+    while start < text_length:
+        end = start + chunk_size
+        chunk = text[start:end]
+        
+        # Try to break at sentence boundary
+        if end < text_length:
+            # Last sentence ending inside [start, end)
+            idx = bisect_left(boundaries, end) - 1
+            break_point = boundaries[idx] - start if idx >= 0 and boundaries[idx] >= start else -1
+            
+            if break_point > chunk_size * 0.5:  # If we found a good break point
+                chunk = text[start:start + break_point + 1]
+                start = start + break_point + 1 - overlap
+            else:
+                start = end - overlap
+        else:
+            start = end
+        
+        if chunk.strip():
+            chunks.append(chunk.strip())
+    
+    return chunks
+
+class FastEmbedEncoder:
+    """Wraps fastembed.TextEmbedding in the encode() interface the rest of RAGSystem uses"""
+    
+    def __init__(self, model_name: str = 'sentence-transformers/all-MiniLM-L6-v2'):
+        from fastembed import TextEmbedding
+        self.model = TextEmbedding(model_name=model_name)
+    
+    def encode(self, texts: List[str], batch_size: int = 256, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False) -> np.ndarray:
+        # Data-parallel workers (parallel=0 -> all cores) only pay off for bulk ingestion
+        parallel = 0 if len(texts) >= 1024 else None
+        embeddings = np.array(list(self.model.embed(texts, batch_size=batch_size, parallel=parallel)),
+                              dtype=np.float32)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        return embeddings
+
+@dataclass
+class PreparedDocuments:
+    """Chunk texts, metadata and IDs as parallel lists, ready for collection.add()"""
+    texts: List[str] = field(default_factory=list)
+    metadatas: List[Dict[str, Any]] = field(default_factory=list)
+    ids: List[str] = field(default_factory=list)
+    
+    def add(self, text: str, base_metadata: Dict[str, Any], chunk_index: int, total_chunks: int, **extra_metadata):
+        """Append one chunk, extending the shared per-source metadata with its position"""
+        self.texts.append(text)
+        self.metadatas.append({**base_metadata, 'chunk_index': chunk_index, 'total_chunks': total_chunks,
+                               **extra_metadata})
+        # Unique ID includes fund_tag to avoid duplicates across funds
+        self.ids.append(f"{base_metadata['fund_tag']}_{base_metadata['source_id']}_chunk_{chunk_index}")
+    
+    def __len__(self) -> int:
+        return len(self.texts)
+
+@lru_cache(maxsize=1)
+def _load_embedding_model(backend: str, device: str, model_file: str = None) -> SentenceTransformer:
+    """Load the embedding model on the given device and backend (fp16 on GPU)
+    
+    Cached per process: every RAGSystem with the same settings (the app's, the assistant's,
+    each test's) shares one model instead of loading its own copy.
+    """
+    if backend == 'ctranslate2':
+        try:
+            from hf_hub_ctranslate2 import CT2SentenceTransformer
+            # int8 weights; keep fp16 activations on GPU
+            compute_type = 'int8_float16' if device == 'cuda' else 'int8'
+            return CT2SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2',
+                                          compute_type=compute_type, device=device)
+        except Exception as e:
+            print(f"⚠ Could not load ctranslate2 backend ({e}), falling back to torch")
+    
+    if backend == 'fastembed':
+        try:
+            return FastEmbedEncoder()
+        except Exception as e:
+            print(f"⚠ Could not load fastembed backend ({e}), falling back to torch")
+    
+    if backend in ('onnx', 'openvino'):
+        model_kwargs = {'file_name': model_file} if model_file else None
+        try:
+            return SentenceTransformer('all-MiniLM-L6-v2', device=device,
+                                       backend=backend, model_kwargs=model_kwargs)
+        except Exception as e:
+            print(f"⚠ Could not load {backend} backend ({e}), falling back to torch")
+    
+    model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+    if device == 'cuda':
+        # Half precision uses tensor cores and halves memory traffic on GPU;
+        # on CPU fp16 is slower than fp32, so it is left as is there
+        model.half()
+    return model
 
 class RAGSystem:
-    def __init__(self, knowledge_base_path='cleaned_knowledge_base.json', vector_store_path='./chroma_db'):
+    # Metrics included in each fund's "Key Metrics" line, in display order
+    FIELD_LABELS = (
+        ('expense_ratio', 'Total Expense Ratio (TER)'),
+        ('nav', 'NAV'),
+        ('aum', 'AUM'),
+        ('benchmark', 'Benchmark'),
+    )
+    
+    def __init__(self, knowledge_base_path='cleaned_knowledge_base.json', vector_store_path='./chroma_db',
+                 add_batch_size: int = 166, encode_batch_size: int = None,
+                 embedding_backend: str = None, embedding_model_file: str = None):
         self.knowledge_base_path = knowledge_base_path
         self.vector_store_path = vector_store_path
-        self.embedding_model = None
+        # Chunks per collection.add() call - keeps each SQLite transaction small
+        self.add_batch_size = add_batch_size
+        self.device = _resolve_device()
+        self.encode_batch_size = encode_batch_size or (128 if self.device == 'cuda' else 32)
+        # 'torch' (default), 'onnx', 'openvino' (sentence-transformers>=3.2), 'ctranslate2' or 'fastembed'
+        self.embedding_backend = (embedding_backend or os.getenv('EMBEDDING_BACKEND', 'torch')).lower()
+        # Optional exported/quantized file inside the model repo, e.g. onnx/model_qint8_avx512_vnni.onnx
+        self.embedding_model_file = embedding_model_file or os.getenv('EMBEDDING_MODEL_FILE')
+        # Fund mentions in a query -> fund_tag (keys are matches with spaces removed)
+        self._fund_re = re.compile(r'large cap|flexi ?cap|elss|tax ?saver|hybrid')
+        self._fund_tag_map = {
+            'largecap': 'LARGE_CAP',
+            'flexicap': 'FLEXI_CAP',
+            'elss': 'ELSS',
+            'taxsaver': 'ELSS',
+            'hybrid': 'HYBRID'
+        }
+        # Optional Chroma server; ingestion to it is done with concurrent async adds
+        self.chroma_host = os.getenv('CHROMA_HOST')
+        self.chroma_port = int(os.getenv('CHROMA_PORT', '8000'))
+        self.max_concurrent_adds = 8
+        # Below this many documents a process pool costs more than it saves
+        self.parallel_chunk_threshold = 64
+        # Parsed knowledge base and the file mtime it was read at
+        self._kb = None
+        self._kb_mtime = None
+        # query string -> embedding, most recently used last
+        self._query_embedding_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()  # queries may be answered from several threads
+        self.query_cache_size = 2048
         self.vector_store = None
         self.collection = None
         
+    @cached_property
+    def embedding_model(self) -> SentenceTransformer:
+        """Embedding model, loaded on first use and kept for the life of the instance"""
+        print(f"Loading embedding model on {self.device}...")
+        model = self._load_embedding_model()
+        if hasattr(model, 'max_seq_length'):
+            # Cap padding/attention length; longer inputs are truncated
+            model.max_seq_length = MAX_SEQ_LENGTH
+        print("✓ Embedding model loaded")
+        return model
+    
+    def _load_embedding_model(self) -> SentenceTransformer:
+        """Load the embedding model on the resolved device and backend (shared per process)"""
+        return _load_embedding_model(self.embedding_backend, self.device, self.embedding_model_file)
+    
+    def _encode_query(self, query: str):
+        """Embed a query, reusing the vector for repeated queries (LRU)"""
+        return self._encode_queries([query])[0]
+    
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed queries, reusing cached vectors and encoding the rest in one forward pass
+        
+        The cache is only touched under its lock; encoding happens outside it.
+        """
+        unique = list(dict.fromkeys(queries))
+        with self._query_cache_lock:
+            found = {q: self._query_embedding_cache[q] for q in unique if q in self._query_embedding_cache}
+        missing = [q for q in unique if q not in found]
+        if missing:
+            embeddings = self.embedding_model.encode(
+                missing,
+                batch_size=len(missing),
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            found.update(zip(missing, embeddings))
+        
+        with self._query_cache_lock:
+            for query in unique:
+                self._query_embedding_cache[query] = found[query]
+                self._query_embedding_cache.move_to_end(query)
+            while len(self._query_embedding_cache) > self.query_cache_size:
+                self._query_embedding_cache.popitem(last=False)
+        return np.stack([found[q] for q in queries])
+    
+    def _encode_documents(self, texts: List[str]) -> np.ndarray:
+        """Embed chunks in length order so each batch pads to similar lengths"""
+        order = np.argsort([len(t) for t in texts], kind='stable')
+        embeddings = self.embedding_model.encode(
+            [texts[i] for i in order],
+            batch_size=self.encode_batch_size,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        # Put rows back in the original chunk order
+        return embeddings[np.argsort(order, kind='stable')]
+    
+    def _embedding_model_id(self) -> str:
+        """Identifies which model/backend produced cached vectors"""
+        return (f"all-MiniLM-L6-v2|{self.embedding_backend}|{self.embedding_model_file or ''}|"
+                f"{self.device}|{MAX_SEQ_LENGTH}")
+    
+    def _encode_documents_cached(self, texts: List[str]) -> np.ndarray:
+        """Embed chunks, reusing vectors from the on-disk cache for unchanged chunk texts"""
+        cache_path = os.path.join(self.vector_store_path, 'embedding_cache.npz')
+        model_id = self._embedding_model_id()
+        
+        cache = {}
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as data:
+                    if str(data['model_id']) == model_id:
+                        cache = dict(zip(data['hashes'].tolist(), data['vectors']))
+            except Exception as e:
+                print(f"⚠ Ignoring unreadable embedding cache ({e})")
+        
+        hashes = [hashlib.blake2b(t.encode('utf-8'), digest_size=16).hexdigest() for t in texts]
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cache:
+                missing[text_hash] = text
+        
+        print(f"Embedding cache: {len(texts) - len(missing)} reused, {len(missing)} to encode")
+        if missing:
+            vectors = self._encode_documents(list(missing.values()))
+            cache.update(zip(missing.keys(), np.asarray(vectors, dtype=np.float32)))
+        
+        embeddings = np.stack([cache[text_hash] for text_hash in hashes])
+        
+        # Keep only the current chunks so the cache tracks the knowledge base
+        try:
+            os.makedirs(self.vector_store_path, exist_ok=True)
+            current = list(dict.fromkeys(hashes))
+            np.savez(cache_path, model_id=np.array(model_id), hashes=np.array(current),
+                     vectors=np.stack([cache[text_hash] for text_hash in current]))
+        except OSError as e:
+            print(f"⚠ Could not save embedding cache ({e})")
+        
+        return embeddings
+    
+    def _kb_is_fresh(self) -> bool:
+        """True if the cached knowledge base matches the file currently on disk"""
+        try:
+            return self._kb is not None and os.path.getmtime(self.knowledge_base_path) == self._kb_mtime
+        except OSError:
+            return False
+    
     def load_knowledge_base(self) -> Dict[str, Any]:
-        """Load and parse cleaned_knowledge_base.json"""
+        """Load and parse cleaned_knowledge_base.json (cached until the file changes)"""
+        if self._kb_is_fresh():
+            return self._kb
+        
         print("Loading knowledge base...")
-        with open(self.knowledge_base_path, 'r', encoding='utf-8') as f:
-            kb = json.load(f)
+        mtime = os.path.getmtime(self.knowledge_base_path)
+        try:
+            import orjson  # Optional: much faster parser
+            with open(self.knowledge_base_path, 'rb') as f:
+                kb = orjson.loads(f.read())
+        except ImportError:
+            with open(self.knowledge_base_path, 'r', encoding='utf-8') as f:
+                kb = json.load(f)
         print(f"✓ Loaded knowledge base with {len(kb.get('funds', {}))} funds")
+        self._kb, self._kb_mtime = kb, mtime
         return kb
     
     def chunk_documents(self, text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
         """Split content into chunks with overlap"""
-        if not text or len(text.strip()) < chunk_size:
-            return [text] if text else []
-        
-        chunks = []
-        start = 0
-        text_length = len(text)
-        
-        while start < text_length:
-            end = start + chunk_size
-            chunk = text[start:end]
-            
-            # Try to break at sentence boundary
-            if end < text_length:
-                # Look for sentence endings
-                last_period = chunk.rfind('.')
-                last_newline = chunk.rfind('\n')
-                break_point = max(last_period, last_newline)
-                
-                if break_point > chunk_size * 0.5:  # If we found a good break point
-                    chunk = text[start:start + break_point + 1]
-                    start = start + break_point + 1 - overlap
-                else:
-                    start = end - overlap
-            else:
-                start = end
-            
-            if chunk.strip():
-                chunks.append(chunk.strip())
+        return _chunk_text(text, chunk_size, overlap)
+    
+    def _chunk_contents(self, contents: List[str]) -> List[List[str]]:
+        """Chunk many documents, across processes when there are enough to pay for the pool"""
+        if len(contents) < self.parallel_chunk_threshold:
+            return [_chunk_text(content) for content in contents]
         
-        return chunks
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            return list(executor.map(_chunk_text, contents, chunksize=4))
     
-    def prepare_documents(self, kb: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def prepare_documents(self, kb: Dict[str, Any]) -> PreparedDocuments:
         """Prepare all documents from knowledge base for chunking"""
-        documents = []
+        # Collect (content, metadata, metrics_text, metrics_on_all_chunks) per source first,
+        # so all chunking can run in one (possibly parallel) pass
+        pending = []
         
         # Process fund schemes (new consolidated structure)
         for fund_tag, fund_data in kb.get('funds', {}).items():
@@ -75,22 +358,12 @@ class RAGSystem:
             if not content or len(content.strip()) < 50:
                 continue
             
-            # Chunk the consolidated content
-            chunks = self.chunk_documents(content)
-            
             # Prepare metrics text
             metrics_text = ""
             has_expense_ratio = 'expense_ratio' in metrics
             if metrics:
-                metrics_parts = []
-                if 'expense_ratio' in metrics and metrics['expense_ratio']:
-                    metrics_parts.append(f"Total Expense Ratio (TER): {metrics['expense_ratio']}")
-                if 'nav' in metrics and metrics['nav'] and metrics['nav'] != ',':
-                    metrics_parts.append(f"NAV: {metrics['nav']}")
-                if 'aum' in metrics and metrics['aum']:
-                    metrics_parts.append(f"AUM: {metrics['aum']}")
-                if 'benchmark' in metrics and metrics['benchmark'] and metrics['benchmark'] != 'Riskometer':
-                    metrics_parts.append(f"Benchmark: {metrics['benchmark']}")
+                # Placeholder values are stripped when the KB is built (consolidation scripts)
+                metrics_parts = [f"{label}: {metrics[key]}" for key, label in self.FIELD_LABELS if metrics.get(key)]
                 if metrics_parts:
                     metrics_text = "\n\nKey Metrics: " + " | ".join(metrics_parts) + "\n"
             
@@ -103,96 +376,122 @@ class RAGSystem:
             if not primary_source and sources:
                 primary_source = sources[0]
             
-            for idx, chunk in enumerate(chunks):
-                chunk_text = chunk
-                # Add metrics to ALL chunks if expense_ratio exists
-                if has_expense_ratio and metrics_text and 'Key Metrics' not in chunk:
-                    chunk_text = metrics_text + chunk
-                # Otherwise, add to first chunk only
-                elif idx == 0 and metrics_text:
-                    chunk_text = metrics_text + chunk
+            # Metadata shared by every chunk of this fund - built once
+            fund_meta = {
+                'source_id': primary_source.get('source_id', 'unknown') if primary_source else 'unknown',
+                'source_title': primary_source.get('source_title', fund_name) if primary_source else fund_name,
+                'source_type': primary_source.get('source_type', 'consolidated') if primary_source else 'consolidated',
+                'url': primary_source.get('url', '') if primary_source else '',
+                'authority': primary_source.get('authority', 'AMC') if primary_source else 'AMC',
+                'fund_name': fund_name,
+                'fund_tag': fund_tag,
+                'all_sources': ', '.join([s.get('source_id', '') for s in sources])  # Track all sources as string
+            }
+            
+            pending.append((content, fund_meta, metrics_text, has_expense_ratio))
+        
+        # Process regulatory and help sources
+        for section, default_type, fund_tag in (('regulatory', 'regulatory', 'REGULATORY'),
+                                                ('help', 'help_page', 'HELP')):
+            for source_id, source_data in kb.get(section, {}).items():
+                content = source_data.get('content', '')
+                if not content or len(content.strip()) < 50:
+                    continue
                 
-                documents.append({
-                    'text': chunk_text,
-                    'metadata': {
-                        'source_id': primary_source.get('source_id', 'unknown') if primary_source else 'unknown',
-                        'source_title': primary_source.get('source_title', fund_name) if primary_source else fund_name,
-                        'source_type': primary_source.get('source_type', 'consolidated') if primary_source else 'consolidated',
-                        'url': primary_source.get('url', '') if primary_source else '',
-                        'authority': primary_source.get('authority', 'AMC') if primary_source else 'AMC',
-                        'fund_name': fund_name,
-                        'fund_tag': fund_tag,
-                        'chunk_index': idx,
-                        'total_chunks': len(chunks),
-                        'all_sources': ', '.join([s.get('source_id', '') for s in sources])  # Track all sources as string
-                    }
-                })
+                source_meta = {
+                    'source_id': source_id,
+                    'source_title': source_data.get('title', ''),
+                    'source_type': source_data.get('type', default_type),
+                    'url': source_data.get('url', ''),
+                    'authority': source_data.get('authority', ''),
+                    'fund_name': '',
+                    'fund_tag': fund_tag
+                }
+                pending.append((content, source_meta, "", False))
         
-        # Process regulatory sources
-        for source_id, reg_data in kb.get('regulatory', {}).items():
-            content = reg_data.get('content', '')
-            if not content or len(content.strip()) < 50:
-                continue
-            
-            chunks = self.chunk_documents(content)
-            
-            for idx, chunk in enumerate(chunks):
-                documents.append({
-                    'text': chunk,
-                    'metadata': {
-                        'source_id': source_id,
-                        'source_title': reg_data.get('title', ''),
-                        'source_type': reg_data.get('type', 'regulatory'),
-                        'url': reg_data.get('url', ''),
-                        'authority': reg_data.get('authority', ''),
-                        'fund_name': '',
-                        'fund_tag': 'REGULATORY',
-                        'chunk_index': idx,
-                        'total_chunks': len(chunks)
-                    }
-                })
+        # Chunk every document, then attach metadata in the original order
+        chunk_lists = self._chunk_contents([item[0] for item in pending])
         
-        # Process help sources
-        for source_id, help_data in kb.get('help', {}).items():
-            content = help_data.get('content', '')
-            if not content or len(content.strip()) < 50:
-                continue
-            
-            chunks = self.chunk_documents(content)
-            
+        documents = PreparedDocuments()
+        for (_, base_meta, metrics_text, has_expense_ratio), chunks in zip(pending, chunk_lists):
             for idx, chunk in enumerate(chunks):
-                documents.append({
-                    'text': chunk,
-                    'metadata': {
-                        'source_id': source_id,
-                        'source_title': help_data.get('title', ''),
-                        'source_type': help_data.get('type', 'help_page'),
-                        'url': help_data.get('url', ''),
-                        'authority': help_data.get('authority', ''),
-                        'fund_name': '',
-                        'fund_tag': 'HELP',
-                        'chunk_index': idx,
-                        'total_chunks': len(chunks)
-                    }
-                })
+                # The first chunk carries the metrics in its text (so they are embedded once)
+                if idx == 0 and metrics_text:
+                    documents.add(metrics_text + chunk, base_meta, idx, len(chunks))
+                # If expense_ratio exists, the other chunks carry them as metadata and
+                # get them prepended at retrieval time instead of storing/embedding N copies
+                elif has_expense_ratio and metrics_text and 'Key Metrics' not in chunk:
+                    documents.add(chunk, base_meta, idx, len(chunks), metrics=metrics_text)
+                else:
+                    documents.add(chunk, base_meta, idx, len(chunks))
         
         print(f"✓ Prepared {len(documents)} document chunks")
         return documents
     
+    def _chroma_client(self):
+        """ChromaDB client (local files, or a Chroma server when CHROMA_HOST is set)"""
+        if self.chroma_host:
+            return chromadb.HttpClient(host=self.chroma_host, port=self.chroma_port)
+        return chromadb.PersistentClient(path=self.vector_store_path)
+    
+    def load_existing(self) -> bool:
+        """Fast path: attach to an already-built collection without reading the knowledge base
+        or loading the embedding model up front.
+        
+        Returns False (caller should run create_vector_store) when the collection is missing or
+        empty, or when the local store is older than the knowledge base file.
+        """
+        if not self.chroma_host:
+            if not os.path.exists(self._store_file) or self._store_is_stale():
+                return False
+        
+        try:
+            collection = self._chroma_client().get_collection("mf_knowledge_base")
+            if collection.count() == 0 or not self._hnsw_params_match(collection):
+                return False
+        except Exception:
+            return False
+        
+        self.collection = collection
+        print(f"✓ Loaded existing vector store ({collection.count()} chunks)")
+        return True
+    
+    @property
+    def _store_file(self) -> str:
+        """Local Chroma database file (its mtime is when the store was last written)"""
+        return os.path.join(self.vector_store_path, 'chroma.sqlite3')
+    
+    def _store_is_stale(self) -> bool:
+        """True if the local store was last written before the knowledge base file changed"""
+        if self.chroma_host:
+            return False
+        try:
+            return os.path.getmtime(self._store_file) < os.path.getmtime(self.knowledge_base_path)
+        except OSError:
+            return False
+    
+    @staticmethod
+    def _hnsw_params_match(collection) -> bool:
+        """True if the collection's index was built with the current HNSW_PARAMS
+        (Chroma fixes them at creation - get_or_create_collection never updates them)"""
+        return (collection.metadata or {}).get("index_params") == INDEX_PARAMS_TAG
+    
     def create_vector_store(self, force_recreate=False):
         """Create vector store with embeddings"""
         print("Creating vector store...")
         
-        # Initialize embedding model
-        print("Loading embedding model...")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        print("✓ Embedding model loaded")
+        # Initialize embedding model up front (cached_property - loaded once per instance)
+        self.embedding_model
         
-        # Initialize ChromaDB
-        client = chromadb.PersistentClient(path=self.vector_store_path)
+        client = self._chroma_client()
         
         # Create or get collection
         collection_name = "mf_knowledge_base"
+        if not force_recreate and self._store_is_stale():
+            # Otherwise the count() check below keeps serving the old chunks (and load_existing
+            # keeps refusing the store) after every knowledge base update
+            print("Knowledge base changed since the vector store was built, rebuilding...")
+            force_recreate = True
         if force_recreate:
             try:
                 client.delete_collection(collection_name)
@@ -201,8 +500,18 @@ class RAGSystem:
         
         self.collection = client.get_or_create_collection(
             name=collection_name,
-            metadata={"description": "HDFC Mutual Fund Knowledge Base"}
+            metadata={"description": "HDFC Mutual Fund Knowledge Base", "index_params": INDEX_PARAMS_TAG,
+                      **HNSW_PARAMS}
         )
+        if not force_recreate and not self._hnsw_params_match(self.collection):
+            # Built with different index parameters - rebuild so the new ones take effect
+            print("Vector store index parameters changed, rebuilding...")
+            client.delete_collection(collection_name)
+            self.collection = client.get_or_create_collection(
+                name=collection_name,
+                metadata={"description": "HDFC Mutual Fund Knowledge Base", "index_params": INDEX_PARAMS_TAG,
+                          **HNSW_PARAMS}
+            )
         
         # Load knowledge base and prepare documents
         kb = self.load_knowledge_base()
@@ -216,107 +525,167 @@ class RAGSystem:
         if self.collection.count() == 0 or force_recreate:
             print(f"Generating embeddings for {len(documents)} chunks...")
             
-            # Extract texts and metadata
-            texts = [doc['text'] for doc in documents]
-            metadatas = [doc['metadata'] for doc in documents]
-            # Create unique IDs by including fund_tag to avoid duplicates
-            ids = [f"{doc['metadata'].get('fund_tag', 'GENERAL')}_{doc['metadata']['source_id']}_chunk_{doc['metadata']['chunk_index']}" 
-                   for doc in documents]
+            texts = documents.texts
+            metadatas = documents.metadatas
+            ids = documents.ids
             
-            # Generate embeddings
-            embeddings = self.embedding_model.encode(texts, show_progress_bar=True)
+            # Generate embeddings (unchanged chunks come from the on-disk cache)
+            embeddings = self._encode_documents_cached(texts)
             
-            # Add to collection
-            self.collection.add(
-                embeddings=embeddings.tolist(),
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
-            )
+            # Add to collection in sub-batches
+            batches = []
+            for start in range(0, len(texts), self.add_batch_size):
+                end = start + self.add_batch_size
+                batches.append({
+                    'embeddings': embeddings[start:end],  # numpy slice view, no list-of-floats copy
+                    'documents': texts[start:end],
+                    'metadatas': metadatas[start:end],
+                    'ids': ids[start:end]
+                })
+            
+            if self.chroma_host:
+                # Server round-trips dominate - keep several adds in flight
+                asyncio.run(self._add_batches_async(collection_name, batches))
+            else:
+                for batch in batches:
+                    self.collection.add(**batch)
             
             print(f"✓ Added {len(documents)} chunks to vector store")
         else:
             print(f"✓ Vector store already contains {self.collection.count()} chunks")
     
+    async def _add_batches_async(self, collection_name: str, batches: List[Dict[str, Any]]):
+        """Add batches to a Chroma server concurrently, at most max_concurrent_adds at a time"""
+        client = await chromadb.AsyncHttpClient(host=self.chroma_host, port=self.chroma_port)
+        collection = await client.get_collection(collection_name)
+        semaphore = asyncio.Semaphore(self.max_concurrent_adds)
+        
+        async def add_one(batch):
+            async with semaphore:
+                await collection.add(**batch)
+        
+        await asyncio.gather(*(add_one(batch) for batch in batches))
+    
+    def _detect_fund_filter(self, query: str) -> str:
+        """Map a fund mentioned in the query to its fund_tag (None if no fund is named)"""
+        match = self._fund_re.search(query.lower())
+        return self._fund_tag_map[match.group(0).replace(' ', '')] if match else None
+    
     def retrieve_relevant_chunks(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
         """Retrieve top-k relevant chunks for a query"""
         if not self.collection:
             raise ValueError("Vector store not initialized. Call create_vector_store() first.")
         
-        if not self.embedding_model:
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        
         # Extract fund name from query to add as filter/boost
-        query_lower = query.lower()
-        fund_filter = None
+        fund_filter = self._detect_fund_filter(query)
         
-        # Map fund mentions to tags
-        fund_mapping = {
-            'large cap': 'LARGE_CAP',
-            'flexi cap': 'FLEXI_CAP',
-            'flexicap': 'FLEXI_CAP',
-            'elss': 'ELSS',
-            'taxsaver': 'ELSS',
-            'tax saver': 'ELSS',
-            'hybrid': 'HYBRID'
-        }
+        # Generate query embedding (cached for repeated queries)
+        query_embedding = self._encode_query(query)
         
-        # Check which fund is mentioned
-        for fund_key, fund_tag in fund_mapping.items():
-            if fund_key in query_lower:
-                fund_filter = fund_tag
-                break
+        # If we have a fund filter, let Chroma filter on fund_tag: fund-specific chunks first,
+        # then fill any remaining slots from the rest of the collection
+        if fund_filter:
+            fund_specific = self._query_chunks(query_embedding, k, where={"fund_tag": fund_filter})
+            rest = []
+            if len(fund_specific) < k:
+                rest = self._query_chunks(query_embedding, k - len(fund_specific),
+                                          where={"fund_tag": {"$ne": fund_filter}})
+            return self._prioritize_chunks(fund_specific, rest, fund_filter, k)
+        
+        return self._prioritize_chunks([], self._query_chunks(query_embedding, k), None, k)
+    
+    def retrieve_relevant_chunks_batch(self, queries: List[str], k: int = 3) -> List[List[Dict[str, Any]]]:
+        """Retrieve top-k chunks for several queries with one encode pass and one query per fund filter"""
+        if not self.collection:
+            raise ValueError("Vector store not initialized. Call create_vector_store() first.")
+        if not queries:
+            return []
         
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode([query])[0]
+        embeddings = self._encode_queries(queries)
         
-        # Query the collection with more results if we have a fund filter
-        n_results = k * 3 if fund_filter else k
-        results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=n_results
-        )
+        # Group queries that share a fund filter so each group is a single collection.query()
+        groups = {}
+        for i, query in enumerate(queries):
+            groups.setdefault(self._detect_fund_filter(query), []).append(i)
         
-        # Parse results
-        all_chunks = []
-        if results['documents'] and len(results['documents'][0]) > 0:
-            for i in range(len(results['documents'][0])):
-                chunk = {
-                    'text': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None
-                }
-                all_chunks.append(chunk)
-        
-        # If we have a fund filter, strongly prioritize chunks from that fund
-        if fund_filter and all_chunks:
-            # Separate chunks by type
-            fund_specific = [c for c in all_chunks if c['metadata'].get('fund_tag') == fund_filter]
-            regulatory = [c for c in all_chunks if c['metadata'].get('fund_tag') == 'REGULATORY']
-            help_docs = [c for c in all_chunks if c['metadata'].get('fund_tag') == 'HELP']
-            other = [c for c in all_chunks if c['metadata'].get('fund_tag') not in [fund_filter, 'REGULATORY', 'HELP']]
+        results = [None] * len(queries)
+        for fund_filter, indices in groups.items():
+            group_embeddings = embeddings[indices]
+            if not fund_filter:
+                for i, chunks in zip(indices, self._query_chunks_batch(group_embeddings, k)):
+                    results[i] = self._prioritize_chunks([], chunks, None, k)
+                continue
+            
+            fund_lists = self._query_chunks_batch(group_embeddings, k, where={"fund_tag": fund_filter})
+            rest_lists = [[] for _ in indices]
+            short = [j for j, chunks in enumerate(fund_lists) if len(chunks) < k]
+            if short:
+                n_fill = k - min(len(fund_lists[j]) for j in short)
+                fill_lists = self._query_chunks_batch(group_embeddings[short], n_fill,
+                                                      where={"fund_tag": {"$ne": fund_filter}})
+                for j, chunks in zip(short, fill_lists):
+                    rest_lists[j] = chunks[:k - len(fund_lists[j])]
             
+            for j, i in enumerate(indices):
+                results[i] = self._prioritize_chunks(fund_lists[j], rest_lists[j], fund_filter, k)
+        
+        return results
+    
+    def _prioritize_chunks(self, fund_specific: List[Dict[str, Any]], rest: List[Dict[str, Any]],
+                           fund_filter: str, k: int) -> List[Dict[str, Any]]:
+        """Order retrieved chunks: requested fund first, regulatory (generic definitions) last"""
+        regulatory = [c for c in rest if c['metadata'].get('fund_tag') == 'REGULATORY']
+        help_docs = [c for c in rest if c['metadata'].get('fund_tag') == 'HELP']
+        other = [c for c in rest if c['metadata'].get('fund_tag') not in ['REGULATORY', 'HELP']]
+        
+        if fund_filter:
             # Prioritize: fund-specific first, then help docs, then other funds, then regulatory
             # Regulatory docs should be LAST because they contain generic definitions
-            chunks = (fund_specific + help_docs + other + regulatory)[:k]
-            
             print(f"Query fund filter: {fund_filter}, Found {len(fund_specific)} fund-specific, {len(regulatory)} regulatory chunks")
-        else:
-            # No specific fund - still prefer fund docs over regulatory
-            fund_chunks = [c for c in all_chunks if c['metadata'].get('fund_tag') not in ['REGULATORY', 'HELP']]
-            regulatory = [c for c in all_chunks if c['metadata'].get('fund_tag') == 'REGULATORY']
-            help_docs = [c for c in all_chunks if c['metadata'].get('fund_tag') == 'HELP']
-            
-            chunks = (fund_chunks + help_docs + regulatory)[:k]
+            return (fund_specific + help_docs + other + regulatory)[:k]
         
-        return chunks
+        # No specific fund - still prefer fund docs over regulatory
+        return (other + help_docs + regulatory)[:k]
+    
+    def _query_chunks(self, query_embedding, n_results: int, where: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Run a single collection query and flatten the results into chunk dicts"""
+        return self._query_chunks_batch(query_embedding[None, :], n_results, where)[0]
+    
+    def _query_chunks_batch(self, query_embeddings: np.ndarray, n_results: int,
+                            where: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Run one collection query for a matrix of embeddings; returns chunk dicts per query row"""
+        query_args = {'query_embeddings': query_embeddings, 'n_results': n_results}
+        if where:
+            query_args['where'] = where
+        results = self.collection.query(**query_args)
+        
+        per_query = []
+        for row in range(len(query_embeddings)):
+            chunks = []
+            documents = results['documents'][row] if results['documents'] else []
+            for i in range(len(documents)):
+                metadata = results['metadatas'][row][i]
+                chunks.append({
+                    # Re-attach fund metrics stored as metadata so the LLM still sees them
+                    'text': metadata.get('metrics', '') + documents[i],
+                    'metadata': metadata,
+                    'distance': results['distances'][row][i] if results.get('distances') else None
+                })
+            per_query.append(chunks)
+        return per_query
     
     def get_last_updated_date(self) -> str:
         """Get the last updated date from knowledge base metadata"""
         try:
-            with open(self.knowledge_base_path, 'r', encoding='utf-8') as f:
-                kb = json.load(f)
-            created_at = kb.get('metadata', {}).get('created_at', '')
+            if self._kb_is_fresh():
+                created_at = self._kb.get('metadata', {}).get('created_at', '')
+            else:
+                try:
+                    import ijson  # Optional: read only metadata.created_at instead of the whole file
+                    with open(self.knowledge_base_path, 'rb') as f:
+                        created_at = next(ijson.items(f, 'metadata.created_at'), '')
+                except ImportError:
+                    created_at = self.load_knowledge_base().get('metadata', {}).get('created_at', '')
             if created_at:
                 # Format date nicely
                 from datetime import datetime
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the scheme consolidation scripts
+(consolidate_scheme_data.py, llm_consolidate_schemes.py, llm_consolidate_schemes_local.py)
+"""
+
+import io
+import json
+from collections import deque
+from typing import Dict, Iterable, Any
+
+try:
+    import orjson  # Optional: faster parse of the extracted object
+except ImportError:
+    orjson = None
+
+def sanitize_metrics(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop placeholder values picked up from page layout (e.g. ',' for NAV, 'Riskometer' as benchmark)
+
+    Applied on every path that writes fund metrics to a knowledge base file, so readers
+    (RAGSystem.prepare_documents) only need a truthy check.
+    """
+    sanitized = {}
+    for key, value in metrics.items():
+        if isinstance(value, str) and value.strip() in ('', ',', 'null'):
+            continue
+        if key == 'benchmark' and value == 'Riskometer':
+            continue
+        sanitized[key] = value
+    return sanitized
+
+def bounded_concat(parts: Iterable[str], head_budget: int = 35000, tail_budget: int = 5000,
+                   marker: str = "\n\n[... content truncated ...]\n\n") -> str:
+    """Join parts, keeping only the first head_budget and last tail_budget chars (with marker
+    between) when the total is longer than both; the oversized middle is never built.
+    With tail_budget=0 the result is the head followed by the marker."""
+    head = io.StringIO()
+    head_left = head_budget
+    tail = deque()
+    tail_len = 0
+    total = 0
+    
+    for part in parts:
+        total += len(part)
+        if head_left:
+            head.write(part[:head_left])
+            taken = min(len(part), head_left)
+            head_left -= taken
+            part = part[taken:] if taken < len(part) else ''
+        if part and tail_budget:
+            part = part[-tail_budget:]
+            tail.append(part)
+            tail_len += len(part)
+            # Drop whole pieces that are no longer needed for the last tail_budget chars
+            while tail_len - len(tail[0]) >= tail_budget:
+                tail_len -= len(tail.popleft())
+    
+    rest = "".join(tail)
+    if total <= head_budget + tail_budget:
+        return head.getvalue() + rest
+    return head.getvalue() + marker + rest[len(rest) - tail_budget:]
+
+def extract_first_json_object(text: str) -> Any:
+    """Parse the first top-level {...} in text, ignoring prose or code fences around it
+    
+    One linear scan tracks brace depth (outside strings) to find where the object ends,
+    then json.loads runs once on that slice. Raises json.JSONDecodeError when there is
+    no complete object or it is not valid JSON.
+    """
+    start = text.find('{')
+    if start == -1:
+        raise json.JSONDecodeError("Expecting '{'", text, 0)
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                # orjson.JSONDecodeError subclasses json.JSONDecodeError
+                return orjson.loads(text[start:i + 1]) if orjson is not None else json.loads(text[start:i + 1])
+    raise json.JSONDecodeError("Unterminated object", text, start)
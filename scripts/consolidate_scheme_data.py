@@ -9,6 +9,8 @@ import re
 from typing import Dict, List, Any, Set
 from collections import defaultdict
 
+from _consolidation_utils import sanitize_metrics
+
 class SchemeConsolidator:
     def __init__(self):
         self.seen_sentences = set()
@@ -162,7 +164,7 @@ class SchemeConsolidator:
             'fund_name': fund_name,
             'scheme_tag': fund_tag,
             'content': final_content,
-            'metrics': all_metrics,
+            'metrics': sanitize_metrics(all_metrics),
             'sources': all_sources,
             'last_updated': fund_data.get('last_updated', '')
         }
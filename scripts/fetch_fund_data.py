@@ -16,7 +16,8 @@ import re
 from urllib.parse import urlparse
 
 class FundDataFetcher:
-    def __init__(self):
+    def __init__(self, session=None):
+        """session: optional shared requests.Session (keep-alive connections across fetchers)"""
         self.funds_data = {
             'LARGE_CAP': {
                 'fund_name': 'HDFC Large Cap Fund',
@@ -42,6 +43,7 @@ class FundDataFetcher:
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self.session = session or requests.Session()
         
     def read_sources_csv(self):
         """Read the sources CSV file"""
@@ -56,7 +58,7 @@ class FundDataFetcher:
         """Fetch webpage content"""
         for attempt in range(max_retries):
             try:
-                response = requests.get(url, headers=self.headers, timeout=30)
+                response = self.session.get(url, headers=self.headers, timeout=30)
                 response.raise_for_status()
                 return response.text
             except Exception as e:
@@ -70,7 +72,7 @@ class FundDataFetcher:
     def extract_pdf_text(self, url):
         """Download and extract text from PDF"""
         try:
-            response = requests.get(url, headers=self.headers, timeout=60, stream=True)
+            response = self.session.get(url, headers=self.headers, timeout=60, stream=True)
             response.raise_for_status()
             
             # Save temporarily
@@ -15,10 +15,12 @@ import re
 import os
 
 class RegulatorySourceFetcher:
-    def __init__(self):
+    def __init__(self, session=None):
+        """session: optional shared requests.Session (keep-alive connections across fetchers)"""
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self.session = session or requests.Session()
         self.regulatory_data = {}
         
     def read_sources_csv(self):
@@ -36,7 +38,7 @@ class RegulatorySourceFetcher:
         """Fetch webpage content"""
         for attempt in range(max_retries):
             try:
-                response = requests.get(url, headers=self.headers, timeout=30)
+                response = self.session.get(url, headers=self.headers, timeout=30)
                 response.raise_for_status()
                 return response.text
             except Exception as e:
@@ -50,7 +52,7 @@ class RegulatorySourceFetcher:
     def extract_pdf_text(self, url):
         """Download and extract text from PDF"""
         try:
-            response = requests.get(url, headers=self.headers, timeout=60)
+            response = self.session.get(url, headers=self.headers, timeout=60)
             response.raise_for_status()
             
             # Save temporarily
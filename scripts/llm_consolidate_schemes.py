@@ -5,75 +5,82 @@ Uses Gemini API to intelligently extract metrics and consolidate content from al
 Creates a single source of truth for each fund scheme
 """
 
+import asyncio
+import atexit
+import hashlib
+import itertools
 import json
+import logging
+import logging.handlers
 import os
-from typing import Dict, List, Any, Optional
-from datetime import datetime
+import queue
+import random
+import re
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterable, List, Any, Optional, Tuple
+from datetime import datetime, timedelta
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
 
+from _consolidation_utils import bounded_concat, extract_first_json_object, sanitize_metrics
+
+try:
+    import orjson  # Optional: much faster JSON parse/emit
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # Optional: stream the knowledge base one fund at a time
+except ImportError:
+    ijson = None
+
 # Load environment variables
 load_dotenv()
 
-class LLMSchemeConsolidator:
-    def __init__(self, api_key: Optional[str] = None):
-        self.api_key = api_key or os.getenv('GEMINI_API_KEY')
-        if not self.api_key:
-            raise ValueError("Gemini API key not found. Set GEMINI_API_KEY environment variable.")
-        
-        genai.configure(api_key=self.api_key)
-        # Use gemini-2.0-flash (known to work) with fallback
-        try:
-            self.model = genai.GenerativeModel('gemini-2.0-flash')
-        except:
-            self.model = genai.GenerativeModel('gemini-pro-latest')
-        
-        self.safety_settings = {
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-        }
-    
-    def extract_metrics_with_llm(self, fund_name: str, fund_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Use LLM to extract structured metrics from all sources"""
-        
-        # Get content from the main content field (consolidated content)
-        main_content = fund_data.get('content', '')
-        
-        # Also try to get content from sources if available
-        source_contents = []
-        for source in fund_data.get('sources', []):
-            content = source.get('content', '')
-            if content and len(content.strip()) > 50:
-                source_title = source.get('source_title', 'Unknown')
-                source_type = source.get('source_type', 'unknown')
-                # Truncate to first 8000 chars per source
-                truncated_content = content[:8000] if len(content) > 8000 else content
-                source_contents.append(f"=== {source_title} ({source_type}) ===\n{truncated_content}\n---END OF SOURCE---")
-        
-        # Combine main content and source contents
-        if source_contents:
-            all_content = main_content + "\n\n" + "\n\n".join(source_contents)
-        else:
-            all_content = main_content
-        
-        # Truncate total content to ~40000 chars to stay within token limits but get more data
-        if len(all_content) > 40000:
-            # Keep first 35000 chars and last 5000 chars to preserve both beginning and end
-            all_content = all_content[:35000] + "\n\n[... content truncated ...]\n\n" + all_content[-5000:]
-        
-        prompt = f"""You are a data extraction expert. Extract structured metrics from mutual fund documents.
+# Errors worth retrying: quota (429) and transient server-side failures
+_RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+
+# Progress output. Records go through a queue to a listener thread, so concurrent fund
+# tasks never wait on stdout. INFO is on whether or not the caller configured logging.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+_log_listener: Optional[logging.handlers.QueueListener] = None
 
-FUND NAME: {fund_name}
+def _start_log_listener():
+    """Send this module's records to stdout via a QueueListener, once per process
+    (skipped when logging is already set up, e.g. by an application embedding the consolidator)"""
+    global _log_listener
+    if _log_listener is not None or logger.hasHandlers():
+        return
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_listener.start()
+    atexit.register(_log_listener.stop)  # writes out whatever is still queued
 
-SOURCE DOCUMENTS:
-{all_content}
+def _flush_log_listener():
+    """Write out queued records now (so they come before any print that follows)"""
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener.start()
 
-TASK: Extract all available metrics from the source documents above. Return ONLY a valid JSON object with this exact structure:
+# Static parts of the two prompts; the fund name and source text are joined in per call
+_METRICS_PROMPT_HEAD = """You are a data extraction expert. Extract structured metrics from mutual fund documents.
 
-{{
+FUND NAME: """
+
+_SOURCE_DOCUMENTS_HEADER = "\n\nSOURCE DOCUMENTS:\n"
+
+_METRICS_SCHEMA = """{
   "expense_ratio": "percentage as string (e.g., '0.96%') or null",
   "benchmark": "exact benchmark index name (e.g., 'NIFTY 100 Total Return Index') or null - DO NOT return 'Riskometer'",
   "nav": "NAV value as number string (e.g., '1234.56') or null",
@@ -86,9 +93,9 @@ TASK: Extract all available metrics from the source documents above. Return ONLY
   "fund_manager": "fund manager name(s) or null",
   "min_investment": "minimum investment amount (e.g., '₹100') or null",
   "lock_in_period": "lock-in period if applicable (e.g., '3 years') or null"
-}}
+}"""
 
-CRITICAL RULES:
+_METRICS_RULES_BASE = """CRITICAL RULES:
 1. Return ONLY the JSON object, no explanations, no markdown, no code blocks
 2. For benchmark: Extract actual index names like "NIFTY 100 TRI", "NIFTY 500 TRI" - NEVER return "Riskometer" or "Benchmark Riskometer". Look for phrases like "NIFTY 100 (Total Return Index)" or "NIFTY 500 TRI"
 3. For expense_ratio: Look for "Total Expense Ratio", "TER", "expense ratio", or numbers like "0.96" followed by "%" - extract the percentage value
@@ -97,47 +104,505 @@ CRITICAL RULES:
 6. For NAV: Look for "NAV" followed by numbers like "1234.56" or dates with NAV values
 7. For exit_load: Look for "Exit Load" or "exit load" and extract the complete description
 8. For riskometer: Look for "Very High", "High", "Moderate", "Low" risk levels
-9. Only include fields where you found actual data in the source documents above - use null for missing fields
-10. If multiple values exist, use the most recent or most authoritative (factsheet > SID > KIM > overview)
+9. Only include fields where you found actual data in the source documents above - use null for missing fields"""
+
+_METRICS_PRIORITY_RULE = "\n10. If multiple values exist, use the most recent or most authoritative ({order})"
+
+_METRICS_RULES = _METRICS_RULES_BASE + _METRICS_PRIORITY_RULE.format(order="factsheet > SID > KIM > overview")
+
+def _metrics_prompt_tail(rules: str) -> str:
+    return "".join([
+        "\n\nTASK: Extract all available metrics from the source documents above. Return ONLY a valid JSON object with this exact structure:\n\n",
+        _METRICS_SCHEMA, "\n\n", rules,
+        "\n\nIMPORTANT: The source documents above contain the actual data. Read through them carefully and extract the real values. Do not return all nulls - the data is there in the documents.",
+        "\n\nBEGIN YOUR RESPONSE WITH { AND END WITH }"
+    ])
+
+# Metrics prompt tails specialised by the ranked source types a fund has:
+# (factsheet, SID, KIM, overview). The priority rule names only the types present,
+# and is left out when fewer than two of them are present.
+_METRICS_SOURCE_RANKING = (("factsheet", "factsheet"), ("sid", "SID"), ("kim", "KIM"), ("scheme_overview", "overview"))
+_METRICS_PROMPT_VARIANTS = {}
+for _shape in itertools.product((False, True), repeat=len(_METRICS_SOURCE_RANKING)):
+    _present = [label for (_, label), has_type in zip(_METRICS_SOURCE_RANKING, _shape) if has_type]
+    if len(_present) > 1:
+        _METRICS_PROMPT_VARIANTS[_shape] = _metrics_prompt_tail(_METRICS_RULES_BASE + _METRICS_PRIORITY_RULE.format(order=" > ".join(_present)))
+    else:
+        _METRICS_PROMPT_VARIANTS[_shape] = _metrics_prompt_tail(_METRICS_RULES_BASE)
+
+# Several funds per request (same schema and rules, one object per fund tag)
+_METRICS_BATCH_PROMPT_HEAD = """You are a data extraction expert. Extract structured metrics from mutual fund documents for each of the funds below.
+"""
+
+_METRICS_BATCH_PROMPT_TAIL = "".join([
+    "\n\nTASK: For each fund above, extract all available metrics from that fund's own source documents only. Return ONLY a valid JSON object keyed by the fund tag shown in each FUND header, where every value has this exact structure:\n\n",
+    _METRICS_SCHEMA, "\n\n", _METRICS_RULES,
+    "\n11. Include every fund tag from the FUND headers as a key, even if all its fields are null",
+    "\n\nIMPORTANT: The source documents above contain the actual data. Read through them carefully and extract the real values. Do not return all nulls - the data is there in the documents.",
+    "\n\nBEGIN YOUR RESPONSE WITH { AND END WITH }"
+])
+
+_CONSOLIDATE_PROMPT_HEAD = """You are a financial data consolidation expert. Consolidate information from multiple mutual fund sources into one comprehensive, clean knowledge base entry.
+
+FUND NAME: """
+
+_CONSOLIDATE_PROMPT_MIDDLE = """
+
+TASK: Create a single consolidated knowledge base entry by:
+1. Removing ALL duplicates and redundant information
+2. Removing navigation elements, footers, headers, and noise (like "Click here", "Follow us", "Careers", "Contact us", etc.)
+3. Organizing information in a logical, readable structure
+4. Preserving ALL unique factual information
+5. Keeping important details: investment objective, exit load, fund manager, scheme features, investment strategy, etc.
+
+OUTPUT FORMAT (use these sections):
+=== """
+
+_CONSOLIDATE_PROMPT_TAIL = """ ===
+
+Investment Objective:
+[Complete investment objective statement]
+
+Key Features:
+[Important scheme features and characteristics]
+
+Exit Load:
+[Complete exit load details]
+
+Fund Manager:
+[Fund manager name(s)]
+
+Investment Strategy:
+[How the fund invests, asset allocation, etc.]
+
+Other Information:
+[Any other relevant factual information]
+
+CRITICAL: 
+- Return ONLY the consolidated content, no explanations, no "I'm ready" messages
+- Start directly with the fund name section
+- Remove all navigation, footer, and header noise
+- Keep factual information only, no opinions or advice"""
+
+
+# System instruction for a fund's cached source context (see LLMSchemeConsolidator.context_cache)
+_CONTEXT_SYSTEM_INSTRUCTION = ("You are a mutual fund data expert. The source documents for one fund are provided "
+                               "below; answer each task using only these documents.")
+
+
+# Fallback metric extraction: every pattern as one lookahead alternation, so a single
+# pass over the content finds the first match of each (match.lastgroup names the pattern)
+_FALLBACK_METRICS_RE = re.compile(
+    r'(?=(?:'
+    r'(?P<expense_ratio>expense\s+ratio[:\s]*(?P<er_value>[\d.]+))'
+    r'|(?P<bench_tri>NIFTY\s+\d+\s+(?:Total\s+Return\s+Index|TRI))'
+    r'|(?P<bench_nifty>NIFTY\s+\d+)'
+    r'|(?P<bench_bse>BSE\s+\w+)'
+    r'|benchmark[:\s]*(?P<bench_named>[A-Z][^.\n]{5,50}?(?:Index|TRI))'
+    r'|nav[:\s]*₹?\s*(?P<nav>[\d,]+\.?\d*)'
+    r'|aum[:\s]*₹?\s*(?P<aum>[\d,]+\.?\d*)\s*(?P<aum_unit>Cr|Crore|Lakh|L)'
+    r'|exit\s+load[:\s]*(?P<exit_load>[^.\n]{20,300})'
+    r'|riskometer[:\s]*(?P<riskometer>Very\s+High|High|Moderate|Low|Moderately\s+High)'
+    r'|investment\s+objective[:\s]*(?P<investment_objective>[^.\n]{30,400})'
+    r'))',
+    re.IGNORECASE
+)
+_FALLBACK_KIND_COUNT = 10
+_BENCHMARK_KINDS = ('bench_tri', 'bench_nifty', 'bench_bse', 'bench_named')
+_RETURN_RE = re.compile(r'(\d+)\.(\d+)%')
+
+# Fallback consolidation: paragraph split, punctuation strip and navigation/footer noise check
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n{2,}')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_NOISE_WORDS = ('click here', 'follow us', 'careers', 'contact us', 'home', 'statutory disclosures')
+_NOISE_RE = re.compile('|'.join(map(re.escape, _NOISE_WORDS)))
+try:
+    import ahocorasick  # Optional: finds any noise word in one pass over the text
+    _NOISE_AUTOMATON = ahocorasick.Automaton()
+    for _word in _NOISE_WORDS:
+        _NOISE_AUTOMATON.add_word(_word, _word)
+    _NOISE_AUTOMATON.make_automaton()
+except ImportError:
+    _NOISE_AUTOMATON = None
+
+def _contains_noise(text: str) -> bool:
+    """True if text contains any navigation/footer noise word"""
+    if _NOISE_AUTOMATON is not None:
+        return next(_NOISE_AUTOMATON.iter(text), None) is not None
+    return _NOISE_RE.search(text) is not None
+
+def _source_digest(content: str) -> str:
+    """Identify a source by the text that reaches the prompts (its first 8000 chars)"""
+    return hashlib.blake2b(content[:8000].encode('utf-8'), digest_size=16).hexdigest()
+
+def _load_json(path: str) -> Any:
+    """Read a JSON file (orjson when installed)"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _dump_json(data: Any, path: str):
+    """Write data as indented UTF-8 JSON (orjson when installed, same layout as json.dump(indent=2))"""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+def _iter_json_items(path: str, prefix: str) -> Iterable[Tuple[str, Any]]:
+    """Yield the (key, value) pairs of the object at prefix, building one value at a time (ijson)"""
+    with open(path, 'rb') as f:
+        yield from ijson.kvitems(f, prefix, use_float=True)
+
+def _stream_json_sections(path: str, stream_key: str, sections: Dict[str, Any]) -> Iterable[Tuple[str, Any]]:
+    """One ijson pass over a JSON object: yield the (key, value) pairs under stream_key one at a time
+    and build every other top-level section into sections as it is reached"""
+    section = builder = None
+    item_key = item_builder = None
+    with open(path, 'rb') as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if prefix == '':
+                if builder is not None:
+                    sections[section] = builder.value
+                builder = None
+                if event == 'map_key':
+                    section = value
+                    if value != stream_key:
+                        builder = ijson.ObjectBuilder()
+            elif section != stream_key:
+                builder.event(event, value)
+            elif prefix != stream_key:
+                item_builder.event(event, value)
+            elif event in ('map_key', 'end_map'):
+                if item_builder is not None:
+                    yield item_key, item_builder.value
+                item_key, item_builder = value, ijson.ObjectBuilder()
+
+class ResponseCache:
+    """SQLite-backed cache of LLM responses keyed by a hash of prompt + model + generation config
+    
+    Policies:
+        enabled   - read hits, write new responses
+        read_only - read hits, never write
+        replay    - read hits, raise on a miss (iterate on parsing without API calls)
+        disabled  - no caching
+    """
+    POLICIES = ('enabled', 'read_only', 'replay', 'disabled')
+    
+    def __init__(self, path: str = 'data/llm_response_cache.sqlite', policy: str = 'enabled'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}'. Use one of: {', '.join(self.POLICIES)}")
+        self.policy = policy
+        self.conn = None
+        if policy != 'disabled':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, response TEXT, created_at REAL)")
+            self.conn.commit()
+    
+    @staticmethod
+    def make_key(model_name: str, generation_config: Dict[str, Any], prompt: str) -> str:
+        """Deterministic key for one LLM call"""
+        raw = f"{model_name}|{generation_config.get('temperature')}|{generation_config.get('max_output_tokens')}|{prompt}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        if not self.conn:
+            return None
+        row = self.conn.execute("SELECT response FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def put(self, key: str, response: str):
+        if not self.conn or self.policy != 'enabled':
+            return
+        self.conn.execute("INSERT OR REPLACE INTO cache(key, response, created_at) VALUES (?, ?, ?)",
+                          (key, response, time.time()))
+        self.conn.commit()
 
-IMPORTANT: The source documents above contain the actual data. Read through them carefully and extract the real values. Do not return all nulls - the data is there in the documents.
+class SemanticCache:
+    """Opt-in near-duplicate cache: reuses a response when a fund's source text embeds
+    close enough (cosine >= threshold) to source text already sent with the same kind of prompt.
+    Only content consolidation uses it; metrics extraction relies on the exact-match cache alone.
+    
+    The fund name is replaced with <FUND> before embedding and in stored responses, so a hit
+    for another fund gets its own name substituted back in.
+    """
+    
+    def __init__(self, path: str = 'data/llm_semantic_cache.sqlite', threshold: float = 0.97):
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+        self.np = np
+        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.threshold = threshold
+        self.lookups = 0
+        self.hits = 0
+        
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS semantic_cache(namespace TEXT, embedding BLOB, response TEXT)")
+        self.conn.commit()
+        
+        # namespace -> ([embedding, ...], [response, ...])
+        self.entries = {}
+        for namespace, blob, response in self.conn.execute("SELECT namespace, embedding, response FROM semantic_cache"):
+            vectors, responses = self.entries.setdefault(namespace, ([], []))
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+            responses.append(response)
+    
+    def embed(self, text: str, fund_name: str):
+        """Embed the whole text (mean of ~1000-char pieces, since MiniLM only reads 256 tokens)"""
+        if fund_name:
+            text = text.replace(fund_name, '<FUND>')
+        pieces = [text[i:i + 1000] for i in range(0, len(text), 1000)] or ['']
+        embedding = self.model.encode(pieces, normalize_embeddings=True).mean(axis=0)
+        return (embedding / max(self.np.linalg.norm(embedding), 1e-12)).astype(self.np.float32)
+    
+    def lookup(self, namespace: str, embedding, fund_name: str) -> Optional[str]:
+        self.lookups += 1
+        vectors, responses = self.entries.get(namespace, ([], []))
+        if not vectors:
+            return None
+        similarities = self.np.stack(vectors) @ embedding
+        best = int(similarities.argmax())
+        if similarities[best] < self.threshold:
+            return None
+        self.hits += 1
+        return responses[best].replace('<FUND>', fund_name)
+    
+    def add(self, namespace: str, embedding, response: str, fund_name: str):
+        if fund_name:
+            response = response.replace(fund_name, '<FUND>')
+        vectors, responses = self.entries.setdefault(namespace, ([], []))
+        vectors.append(embedding)
+        responses.append(response)
+        self.conn.execute("INSERT INTO semantic_cache(namespace, embedding, response) VALUES (?, ?, ?)",
+                          (namespace, embedding.tobytes(), response))
+        self.conn.commit()
 
-BEGIN YOUR RESPONSE WITH {{ AND END WITH }}"""
+class GeminiRateLimiter:
+    """Token bucket on both requests/minute and tokens/minute, shared by all concurrent fund tasks
+    
+    Waiting here for the bucket to refill is cheaper than finding the quota via a 429
+    and sitting through the exponential backoff.
+    """
+    
+    def __init__(self, requests_per_minute: int = 60, tokens_per_minute: int = 1_000_000):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_tokens = float(requests_per_minute)
+        self.token_tokens = float(tokens_per_minute)
+        self.last_update = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.request_tokens = min(self.requests_per_minute, self.request_tokens + elapsed * self.requests_per_minute / 60)
+        self.token_tokens = min(self.tokens_per_minute, self.token_tokens + elapsed * self.tokens_per_minute / 60)
+        self.last_update = now
+    
+    async def acquire(self, estimated_tokens: int, non_blocking: bool = False) -> bool:
+        """Take capacity for one request. With non_blocking=True, returns False (deferred)
+        instead of waiting when the bucket is short."""
+        estimated_tokens = min(estimated_tokens, self.tokens_per_minute)
+        while True:
+            async with self._lock:
+                self._refill()
+                if self.request_tokens >= 1 and self.token_tokens >= estimated_tokens:
+                    self.request_tokens -= 1
+                    self.token_tokens -= estimated_tokens
+                    return True
+                if non_blocking:
+                    return False
+                wait = max((1 - self.request_tokens) * 60 / self.requests_per_minute,
+                           (estimated_tokens - self.token_tokens) * 60 / self.tokens_per_minute)
+            await asyncio.sleep(max(wait, 0.01))
 
+class LLMSchemeConsolidator:
+    def __init__(self, api_key: Optional[str] = None, cache_policy: Optional[str] = None,
+                 cache_path: str = 'data/llm_response_cache.sqlite', semantic_cache: Optional[bool] = None,
+                 max_concurrency: int = 8, metrics_batch_size: Optional[int] = None,
+                 mode: Optional[str] = None, context_cache: Optional[bool] = None):
+        self.api_key = api_key or os.getenv('GEMINI_API_KEY')
+        if not self.api_key:
+            raise ValueError("Gemini API key not found. Set GEMINI_API_KEY environment variable.")
+        _start_log_listener()  # progress output for direct callers too, not just consolidate_all
+        
+        genai.configure(api_key=self.api_key)
+        # Use gemini-2.0-flash (known to work) with fallback
         try:
-            generation_config = {
-                "temperature": 0.0,  # Lower temperature for more consistent extraction
-                "max_output_tokens": 2000,
-            }
-            
-            # Retry logic for rate limits
-            max_retries = 3
-            retry_delay = 2
-            
-            for attempt in range(max_retries):
-                try:
-                    response = self.model.generate_content(
-                        prompt,
-                        generation_config=generation_config,
-                        safety_settings=self.safety_settings
-                    )
-                    break
-                except Exception as e:
-                    if "429" in str(e) or "Resource exhausted" in str(e):
-                        if attempt < max_retries - 1:
-                            print(f"  ⚠️ Rate limit hit, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries})")
-                            import time
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                            continue
+            self.model = genai.GenerativeModel('gemini-2.0-flash')
+        except:
+            self.model = genai.GenerativeModel('gemini-pro-latest')
+        
+        self.safety_settings = {
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+        }
+        
+        # Generation configs are built once and shared by every call
+        self._metrics_gen_config = {
+            "temperature": 0.0,  # Lower temperature for more consistent extraction
+            "max_output_tokens": 2000,
+        }
+        self._consolidate_gen_config = {
+            "temperature": 0.1,  # Lower temperature for more consistent output
+            "max_output_tokens": 8000,
+        }
+        
+        # Funds consolidated at once (each issues two concurrent Gemini calls)
+        self.max_concurrency = max_concurrency
+        
+        # Funds per metrics-extraction request (1 = one request per fund)
+        if metrics_batch_size is None:
+            metrics_batch_size = int(os.getenv('LLM_METRICS_BATCH_SIZE', '1'))
+        self.metrics_batch_size = max(1, metrics_batch_size)
+        self.metrics_batch_chars = 30000  # source text budget per batched request
+        self.metrics_batch_fund_chars = 6000  # source text budget per fund in a batch
+        
+        self.rate_limiter = GeminiRateLimiter(
+            requests_per_minute=int(os.getenv('GEMINI_RPM', '60')),
+            tokens_per_minute=int(os.getenv('GEMINI_TPM', '1000000'))
+        )
+        
+        self.cache = ResponseCache(cache_path, cache_policy or os.getenv('LLM_CACHE_POLICY', 'enabled'))
+        
+        # 'batch' submits the whole run to the Gemini Batch API (half price, no interactive quota)
+        # and waits for it; 'interactive' calls the model per fund as results are needed
+        self.mode = mode or os.getenv('LLM_MODE', 'interactive')
+        if self.mode not in ('interactive', 'batch'):
+            raise ValueError(f"Unknown mode '{self.mode}'. Use 'interactive' or 'batch'.")
+        self.batch_poll_interval = 30  # seconds
+        self.batch_timeout = 24 * 3600  # Batch API jobs complete within 24 hours
+        self._batch_responses = {}  # cache key -> response text from batch jobs
+        
+        # Optional near-duplicate cache (off by default - a hit reuses another fund's answer)
+        if semantic_cache is None:
+            semantic_cache = os.getenv('LLM_SEMANTIC_CACHE', 'false').lower() == 'true'
+        self.semantic_cache = None
+        if semantic_cache and self.cache.policy != 'disabled':
+            try:
+                threshold = float(os.getenv('LLM_SEMANTIC_CACHE_THRESHOLD', '0.97'))
+                self.semantic_cache = SemanticCache(threshold=threshold)
+            except ImportError as e:
+                print(f"⚠️ Semantic cache unavailable ({e}). Continuing without it.")
+        
+        # Optional Gemini context caching: each fund's sources are uploaded once and shared
+        # by its metrics and consolidation calls, which then only send the task prompt
+        if context_cache is None:
+            context_cache = os.getenv('LLM_CONTEXT_CACHE', 'false').lower() == 'true'
+        self.context_cache = context_cache
+        self.context_cache_min_chars = 4096 * 4  # below ~4096 tokens the API refuses to cache
+    
+    async def _generate_text(self, prompt: str, generation_config: Dict[str, Any],
+                       semantic_text: Optional[str] = None, fund_name: str = '',
+                       model: Any = None, cache_prompt: Optional[str] = None) -> Optional[str]:
+        """Call Gemini (with the response caches and rate-limit retries)
+        
+        semantic_text is the fund's source text, used for the optional near-duplicate lookup
+        (consolidation only - near-identical sources can still differ in the exact figures metrics extracts).
+        model/cache_prompt: a model bound to cached context, and the full prompt it stands for
+        (used for the cache key and token estimate).
+        Returns the stripped response text, or None if the response was blocked or incomplete.
+        """
+        model = model or self.model
+        cache_prompt = cache_prompt or prompt
+        cache_key = ResponseCache.make_key(self.model.model_name, generation_config, cache_prompt)
+        if cache_key in self._batch_responses:
+            return self._batch_responses[cache_key]
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"  ✓ Using cached LLM response")
+            return cached
+        
+        embedding = None
+        if self.semantic_cache and semantic_text and generation_config is not self._metrics_gen_config:
+            # Same model and config means the same kind of prompt
+            namespace = f"{self.model.model_name}|{generation_config.get('temperature')}|{generation_config.get('max_output_tokens')}"
+            embedding = self.semantic_cache.embed(semantic_text, fund_name)
+            cached = self.semantic_cache.lookup(namespace, embedding, fund_name)
+            if cached is not None:
+                logger.info(f"  ✓ Using semantically cached LLM response")
+                return cached
+        
+        if self.cache.policy == 'replay':
+            raise LookupError(f"No cached LLM response for key {cache_key[:12]}... (cache policy is 'replay')")
+        
+        # Retry quota and transient server errors with jittered exponential backoff;
+        # anything else (bad request, permissions) fails straight away
+        max_attempts = 5
+        
+        for attempt in range(max_attempts):
+            try:
+                # ~4 chars per token for the prompt, plus the output budget
+                await self.rate_limiter.acquire(len(cache_prompt) // 4 + generation_config.get('max_output_tokens', 0))
+                response = await model.generate_content_async(
+                    prompt,
+                    generation_config=generation_config,
+                    safety_settings=self.safety_settings
+                )
+                break
+            except _RETRYABLE_ERRORS as e:
+                if attempt == max_attempts - 1:
                     raise
+                # 1s, 2s, 4s, ... capped at 30s, +/-25% so funds that hit the limit together spread out
+                retry_delay = min(2 ** attempt, 30) * random.uniform(0.75, 1.25)
+                logger.info(f"  ⚠️ {type(e).__name__}, retrying in {retry_delay:.1f} seconds... (attempt {attempt + 1}/{max_attempts})")
+                await asyncio.sleep(retry_delay)  # let other funds progress meanwhile
+        
+        if response.candidates and response.candidates[0].finish_reason == 1:  # STOP
+            text = response.text.strip()
+            self.cache.put(cache_key, text)
+            if embedding is not None and self.cache.policy == 'enabled':
+                self.semantic_cache.add(namespace, embedding, text, fund_name)
+            return text
+        return None
+    
+    def _metrics_prompt(self, fund_name: str, fund_data: Dict[str, Any],
+                        skip_hashes: frozenset = frozenset()) -> Tuple[str, str]:
+        """Build the metrics prompt; returns (prompt, source text)
+        
+        skip_hashes: digests of sources already supplied through a shared cached context.
+        """
+        # Get content from the main content field (consolidated content)
+        main_content = fund_data.get('content', '')
+        
+        # Stream main content + sources, keeping first 35000 and last 5000 chars when the
+        # total exceeds 40000 (preserves both beginning and end within token limits)
+        all_content = bounded_concat(self._metrics_source_parts(main_content, fund_data, skip_hashes))
+        
+        prompt = "".join([_METRICS_PROMPT_HEAD, fund_name, _SOURCE_DOCUMENTS_HEADER, all_content,
+                          self._metrics_prompt_variant(fund_data)])
+        return prompt, all_content
+    
+    async def extract_metrics_with_llm(self, fund_name: str, fund_data: Dict[str, Any],
+                                       context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Use LLM to extract structured metrics from all sources (context: from _create_fund_context)"""
+        prompt, all_content = self._metrics_prompt(fund_name, fund_data)
+        model = cache_prompt = None
+        if context is not None and context['shared_hashes']:
+            # Sources shared with other funds are in the cached context - send only this fund's own
+            model, cache_prompt = context['model'], prompt
+            prompt, _ = self._metrics_prompt(fund_name, fund_data, context['shared_hashes'])
+        elif context is not None:
+            # The sources are already in the cached context - send only the task
+            model, cache_prompt = context['model'], prompt
+            prompt = "".join([_METRICS_PROMPT_HEAD, fund_name,
+                              self._metrics_prompt_variant(fund_data)])
+
+        try:
+            result_text = await self._generate_text(prompt, self._metrics_gen_config,
+                                              model=model, cache_prompt=cache_prompt)
             
-            if response.candidates and response.candidates[0].finish_reason == 1:  # STOP
-                result_text = response.text.strip()
-                
+            if result_text is not None:
                 # Check if LLM gave a "ready" response instead of actual extraction
                 if "ready" in result_text.lower() or "please provide" in result_text.lower() or "i'm" in result_text.lower():
-                    print(f"  ⚠️ LLM returned 'ready' response instead of extracting. Using fallback extraction.")
+                    logger.info(f"  ⚠️ LLM returned 'ready' response instead of extracting. Using fallback extraction.")
                     return self._fallback_extract_metrics(all_content)
                 
                 # Extract JSON from response (handle markdown code blocks)
@@ -146,232 +611,301 @@ BEGIN YOUR RESPONSE WITH {{ AND END WITH }}"""
                 elif "```" in result_text:
                     result_text = result_text.split("```")[1].split("```")[0].strip()
                 
-                # Try to find JSON object in response
-                import re
-                json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', result_text, re.DOTALL)
-                if json_match:
-                    result_text = json_match.group(0)
-                
                 try:
-                    metrics = json.loads(result_text)
-                    # Filter out null values and empty strings - only keep fields with actual data
-                    filtered_metrics = {}
-                    for k, v in metrics.items():
-                        if v is not None and v != "null" and v != "" and v != []:
-                            # Also check if it's a list with only null/empty values
-                            if isinstance(v, list):
-                                v = [item for item in v if item is not None and item != "" and item != "null"]
-                                if v:  # Only add if list has items
-                                    filtered_metrics[k] = v
-                            else:
-                                filtered_metrics[k] = v
+                    metrics = extract_first_json_object(result_text)
+                    filtered_metrics = self._drop_empty_metrics(metrics)
                     
                     if not filtered_metrics:
-                        print(f"  ⚠️ All metrics were null. LLM response: {result_text[:500]}...")
-                        print(f"  Using fallback extraction...")
+                        logger.info(f"  ⚠️ All metrics were null. LLM response: {result_text[:500]}...")
+                        logger.info(f"  Using fallback extraction...")
                         fallback_metrics = self._fallback_extract_metrics(all_content)
                         if fallback_metrics:
-                            print(f"  ✓ Fallback extracted: {list(fallback_metrics.keys())}")
+                            logger.info(f"  ✓ Fallback extracted: {list(fallback_metrics.keys())}")
                         return fallback_metrics
                     
                     return filtered_metrics
                 except json.JSONDecodeError as e:
-                    print(f"  ⚠️ JSON parse error: {e}")
-                    print(f"  Response preview: {result_text[:300]}...")
-                    print(f"  Using fallback extraction...")
+                    logger.info(f"  ⚠️ JSON parse error: {e}")
+                    logger.info(f"  Response preview: {result_text[:300]}...")
+                    logger.info(f"  Using fallback extraction...")
                     return self._fallback_extract_metrics(all_content)
             else:
-                print(f"  ⚠️ LLM response blocked or incomplete")
+                logger.info(f"  ⚠️ LLM response blocked or incomplete")
                 return {}
                 
+        except LookupError:
+            raise  # replay policy: a cache miss must stop the run, not fall back to regex output
         except Exception as e:
-            print(f"  ⚠️ Error extracting metrics with LLM: {e}")
+            logger.info(f"  ⚠️ Error extracting metrics with LLM: {e}")
             return self._fallback_extract_metrics(all_content)
     
+    @staticmethod
+    def _drop_empty_metrics(metrics: Dict[str, Any]) -> Dict[str, Any]:
+        """Filter out null values and empty strings - only keep fields with actual data"""
+        filtered_metrics = {}
+        for k, v in metrics.items():
+            if v is not None and v != "null" and v != "" and v != []:
+                # Also check if it's a list with only null/empty values
+                if isinstance(v, list):
+                    v = [item for item in v if item is not None and item != "" and item != "null"]
+                    if v:  # Only add if list has items
+                        filtered_metrics[k] = v
+                else:
+                    filtered_metrics[k] = v
+        return filtered_metrics
+    
+    async def extract_metrics_batch(self, fund_items: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+        """Extract metrics for several funds with one LLM request
+        
+        Returns {fund_tag: metrics} for the funds the response covered with at least one
+        field; funds missing from the result should go through extract_metrics_with_llm.
+        """
+        prompt, generation_config = self._metrics_batch_prompt(fund_items)
+        
+        try:
+            result_text = await self._generate_text(prompt, generation_config)
+        except LookupError:
+            raise  # replay policy: a cache miss must stop the run
+        except Exception as e:
+            logger.info(f"  ⚠️ Error extracting batched metrics with LLM: {e}")
+            return {}
+        if result_text is None:
+            logger.info(f"  ⚠️ Batched LLM response blocked or incomplete")
+            return {}
+        
+        try:
+            parsed = extract_first_json_object(result_text)
+        except json.JSONDecodeError as e:
+            logger.info(f"  ⚠️ JSON parse error in batched metrics: {e}")
+            return {}
+        if not isinstance(parsed, dict):
+            return {}
+        
+        results = {}
+        for fund_tag, _ in fund_items:
+            metrics = parsed.get(fund_tag)
+            if isinstance(metrics, dict):
+                metrics = self._drop_empty_metrics(metrics)
+                if metrics:
+                    results[fund_tag] = metrics
+        return results
+    
+    def _metrics_batch_prompt(self, fund_items: List[Tuple[str, Dict[str, Any]]]) -> Tuple[str, Dict[str, Any]]:
+        """Build the batched metrics prompt; returns (prompt, generation config)"""
+        fund_chars = self.metrics_batch_fund_chars
+        sections = []
+        for i, (fund_tag, fund_data) in enumerate(fund_items, 1):
+            content = bounded_concat(self._metrics_source_parts(fund_data.get('content', ''), fund_data),
+                                     head_budget=fund_chars * 5 // 6, tail_budget=fund_chars // 6)
+            sections.append(f"\n=== FUND {i}: {fund_tag} ({fund_data.get('fund_name', '')}) ===\n{content}\n")
+        
+        prompt = "".join([_METRICS_BATCH_PROMPT_HEAD, _SOURCE_DOCUMENTS_HEADER, *sections, _METRICS_BATCH_PROMPT_TAIL])
+        generation_config = {
+            "temperature": self._metrics_gen_config["temperature"],
+            "max_output_tokens": min(self._metrics_gen_config["max_output_tokens"] * len(fund_items), 8192),
+        }
+        return prompt, generation_config
+    
+    def _metrics_batches(self, funds: Dict[str, Any]) -> List[List[Tuple[str, Dict[str, Any]]]]:
+        """Group funds into batches of up to metrics_batch_size, keeping each under metrics_batch_chars"""
+        batches = []
+        batch, batch_chars = [], 0
+        for fund_tag, fund_data in funds.items():
+            # Upper bound on what the fund contributes to the prompt
+            fund_chars = min(self.metrics_batch_fund_chars,
+                             sum(len(part) for part in self._metrics_source_parts(fund_data.get('content', ''), fund_data)))
+            if batch and (len(batch) == self.metrics_batch_size or batch_chars + fund_chars > self.metrics_batch_chars):
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append((fund_tag, fund_data))
+            batch_chars += fund_chars
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    @staticmethod
+    def _metrics_prompt_variant(fund_data: Dict[str, Any]) -> str:
+        """Pick the precomputed metrics instructions for the source types this fund actually has"""
+        source_types = [source.get('source_type', '') for source in fund_data.get('sources', [])
+                        if source.get('content') and len(source['content'].strip()) > 50]
+        shape = tuple(any(source_type.startswith(prefix) for source_type in source_types)
+                      for prefix, _ in _METRICS_SOURCE_RANKING)
+        return _METRICS_PROMPT_VARIANTS[shape]
+    
+    @staticmethod
+    def _unique_sources(fund_data: Dict[str, Any], skip_hashes: frozenset = frozenset()):
+        """Yield (digest, source) for each source with content, skipping repeats of the same
+        document (e.g. one factsheet scraped from two URLs) and any digest in skip_hashes"""
+        seen = set(skip_hashes)
+        for source in fund_data.get('sources', []):
+            content = source.get('content', '')
+            if content and len(content.strip()) > 50:
+                digest = _source_digest(content)
+                if digest not in seen:
+                    seen.add(digest)
+                    yield digest, source
+    
+    @staticmethod
+    def _source_block(source: Dict[str, Any]) -> str:
+        """Format one source for the metrics prompt / cached context (first 8000 chars)"""
+        source_title = source.get('source_title', 'Unknown')
+        source_type = source.get('source_type', 'unknown')
+        return f"=== {source_title} ({source_type}) ===\n{source.get('content', '')[:8000]}\n---END OF SOURCE---"
+    
+    @classmethod
+    def _metrics_source_parts(cls, main_content: str, fund_data: Dict[str, Any],
+                              skip_hashes: frozenset = frozenset()):
+        """Yield the metrics prompt's source text piece by piece"""
+        yield main_content
+        for _, source in cls._unique_sources(fund_data, skip_hashes):
+            yield "\n\n"
+            yield cls._source_block(source)
+    
     def _fallback_extract_metrics(self, content: str) -> Dict[str, Any]:
         """Fallback regex-based metric extraction if LLM fails"""
-        import re
+        # One scan records the first match of every pattern
+        first = {}
+        for match in _FALLBACK_METRICS_RE.finditer(content):
+            first.setdefault(match.lastgroup, match)
+            if len(first) == _FALLBACK_KIND_COUNT:
+                break
+        
         metrics = {}
         
         # Expense Ratio
-        er_match = re.search(r'expense\s+ratio[:\s]*([\d.]+)%?', content, re.IGNORECASE)
-        if er_match:
-            metrics['expense_ratio'] = er_match.group(1) + '%'
-        
-        # Benchmark (look for actual index names)
-        bench_patterns = [
-            r'(NIFTY\s+\d+\s+(?:Total\s+Return\s+Index|TRI))',
-            r'(NIFTY\s+\d+)',
-            r'(BSE\s+\w+)',
-            r'benchmark[:\s]*([A-Z][^.\n]{5,50}?(?:Index|TRI))',
-        ]
-        for pattern in bench_patterns:
-            bench_match = re.search(pattern, content, re.IGNORECASE)
-            if bench_match and 'riskometer' not in bench_match.group(1).lower():
-                metrics['benchmark'] = bench_match.group(1).strip()
-                break
+        if 'expense_ratio' in first:
+            metrics['expense_ratio'] = first['expense_ratio'].group('er_value') + '%'
+        
+        # Benchmark (actual index names, most specific pattern first)
+        for kind in _BENCHMARK_KINDS:
+            if kind in first:
+                benchmark = first[kind].group(kind)
+                if 'riskometer' not in benchmark.lower():
+                    metrics['benchmark'] = benchmark.strip()
+                    break
         
         # NAV
-        nav_match = re.search(r'nav[:\s]*₹?\s*([\d,]+\.?\d*)', content, re.IGNORECASE)
-        if nav_match:
-            nav_val = nav_match.group(1).replace(',', '')
-            if nav_val and nav_val != ',':
+        if 'nav' in first:
+            nav_val = first['nav'].group('nav').replace(',', '')
+            if nav_val:
                 metrics['nav'] = nav_val
         
         # AUM
-        aum_match = re.search(r'aum[:\s]*₹?\s*([\d,]+\.?\d*)\s*(Cr|Crore|Lakh|L)', content, re.IGNORECASE)
-        if aum_match:
-            metrics['aum'] = aum_match.group(1) + ' ' + aum_match.group(2)
+        if 'aum_unit' in first:
+            metrics['aum'] = first['aum_unit'].group('aum') + ' ' + first['aum_unit'].group('aum_unit')
         
         # Exit Load
-        exit_match = re.search(r'exit\s+load[:\s]*([^.\n]{20,300})', content, re.IGNORECASE | re.DOTALL)
-        if exit_match:
-            metrics['exit_load'] = exit_match.group(1).strip()[:300]
+        if 'exit_load' in first:
+            metrics['exit_load'] = first['exit_load'].group('exit_load').strip()[:300]
         
         # Riskometer
-        risk_match = re.search(r'riskometer[:\s]*(Very\s+High|High|Moderate|Low|Moderately\s+High)', content, re.IGNORECASE)
-        if risk_match:
-            metrics['riskometer'] = risk_match.group(1)
+        if 'riskometer' in first:
+            metrics['riskometer'] = first['riskometer'].group('riskometer')
         
-        # Returns
+        # Returns (reasonable range 0-100%, compared on the integer/fraction digits)
         returns = []
-        return_matches = re.findall(r'(\d+\.\d+)%', content)
-        for match in return_matches:
-            if float(match) > 0 and float(match) < 100:  # Reasonable return range
-                returns.append(match)
+        for match in _RETURN_RE.finditer(content):
+            whole, fraction = match.group(1), match.group(2)
+            if int(whole) < 100 and (int(whole) > 0 or fraction.strip('0')):
+                returns.append(f"{whole}.{fraction}")
+                if len(returns) == 5:  # Limit to 5 returns
+                    break
         if returns:
-            metrics['returns'] = returns[:5]  # Limit to 5 returns
+            metrics['returns'] = returns
         
         # Investment Objective
-        obj_match = re.search(r'investment\s+objective[:\s]*([^.\n]{30,400})', content, re.IGNORECASE | re.DOTALL)
-        if obj_match:
-            metrics['investment_objective'] = obj_match.group(1).strip()[:400]
+        if 'investment_objective' in first:
+            metrics['investment_objective'] = first['investment_objective'].group('investment_objective').strip()[:400]
         
         return metrics
     
-    def consolidate_content_with_llm(self, fund_name: str, fund_data: Dict[str, Any]) -> str:
-        """Use LLM to consolidate content from all sources, removing duplicates"""
+    def _consolidate_prompt(self, fund_name: str, fund_data: Dict[str, Any],
+                            skip_hashes: frozenset = frozenset()) -> Tuple[str, str, List[Dict[str, Any]]]:
+        """Build the consolidation prompt; returns (prompt, source text, per-source contents)
         
+        skip_hashes: digests of sources already supplied through a shared cached context.
+        """
         # Get main consolidated content
         main_content = fund_data.get('content', '')
         
-        # Also get content from sources if available
+        # Also get content from sources if available (each distinct document once)
         source_contents = []
-        for source in fund_data.get('sources', []):
+        for _, source in self._unique_sources(fund_data, skip_hashes):
             content = source.get('content', '')
-            if content and len(content.strip()) > 50:
-                source_type = source.get('source_type', 'unknown')
-                source_title = source.get('source_title', 'Unknown')
-                # Truncate to first 8000 chars per source
-                truncated_content = content[:8000] if len(content) > 8000 else content
-                source_contents.append({
-                    'type': source_type,
-                    'title': source_title,
-                    'content': truncated_content
-                })
-        
-        # Combine main content and source contents
-        if source_contents:
-            combined_content = main_content + "\n\n" + "\n\n".join([
-                f"=== {src['title']} ({src['type']}) ===\n{src['content']}"
-                for src in source_contents
-            ])
-        else:
-            combined_content = main_content
+            # Truncate to first 8000 chars per source
+            source_contents.append({
+                'type': source.get('source_type', 'unknown'),
+                'title': source.get('source_title', 'Unknown'),
+                'content': content[:8000]
+            })
         
-        # Truncate total to ~40000 chars
-        if len(combined_content) > 40000:
-            combined_content = combined_content[:40000] + "\n\n[Content truncated...]"
+        # Combine main content and source contents, stopping at 40000 chars
+        combined_content = bounded_concat(self._interleave_sources(main_content, source_contents),
+                                          head_budget=40000, tail_budget=0, marker="\n\n[Content truncated...]")
         
-        prompt = f"""You are a financial data consolidation expert. Consolidate information from multiple mutual fund sources into one comprehensive, clean knowledge base entry.
-
-FUND NAME: {fund_name}
-
-SOURCE DOCUMENTS:
-{combined_content}
-
-TASK: Create a single consolidated knowledge base entry by:
-1. Removing ALL duplicates and redundant information
-2. Removing navigation elements, footers, headers, and noise (like "Click here", "Follow us", "Careers", "Contact us", etc.)
-3. Organizing information in a logical, readable structure
-4. Preserving ALL unique factual information
-5. Keeping important details: investment objective, exit load, fund manager, scheme features, investment strategy, etc.
-
-OUTPUT FORMAT (use these sections):
-=== {fund_name} ===
-
-Investment Objective:
-[Complete investment objective statement]
-
-Key Features:
-[Important scheme features and characteristics]
-
-Exit Load:
-[Complete exit load details]
-
-Fund Manager:
-[Fund manager name(s)]
-
-Investment Strategy:
-[How the fund invests, asset allocation, etc.]
-
-Other Information:
-[Any other relevant factual information]
-
-CRITICAL: 
-- Return ONLY the consolidated content, no explanations, no "I'm ready" messages
-- Start directly with the fund name section
-- Remove all navigation, footer, and header noise
-- Keep factual information only, no opinions or advice"""
+        prompt = "".join([_CONSOLIDATE_PROMPT_HEAD, fund_name, _SOURCE_DOCUMENTS_HEADER, combined_content,
+                          _CONSOLIDATE_PROMPT_MIDDLE, fund_name, _CONSOLIDATE_PROMPT_TAIL])
+        return prompt, combined_content, source_contents
+    
+    async def consolidate_content_with_llm(self, fund_name: str, fund_data: Dict[str, Any],
+                                           context: Optional[Dict[str, Any]] = None) -> str:
+        """Use LLM to consolidate content from all sources, removing duplicates (context: from _create_fund_context)"""
+        prompt, combined_content, source_contents = self._consolidate_prompt(fund_name, fund_data)
+        model = cache_prompt = None
+        if context is not None and context['shared_hashes']:
+            # Sources shared with other funds are in the cached context - send only this fund's own
+            model, cache_prompt = context['model'], prompt
+            prompt, _, _ = self._consolidate_prompt(fund_name, fund_data, context['shared_hashes'])
+        elif context is not None:
+            # The cached context holds the metrics-style source text; key the response on that
+            model = context['model']
+            cache_prompt = "".join([_CONSOLIDATE_PROMPT_HEAD, fund_name, _SOURCE_DOCUMENTS_HEADER, context['source_text'],
+                                    _CONSOLIDATE_PROMPT_MIDDLE, fund_name, _CONSOLIDATE_PROMPT_TAIL])
+            prompt = "".join([_CONSOLIDATE_PROMPT_HEAD, fund_name, _CONSOLIDATE_PROMPT_MIDDLE, fund_name,
+                              _CONSOLIDATE_PROMPT_TAIL])
 
         try:
-            generation_config = {
-                "temperature": 0.1,  # Lower temperature for more consistent output
-                "max_output_tokens": 8000,
-            }
-            
-            # Retry logic for rate limits
-            max_retries = 3
-            retry_delay = 2
-            
-            for attempt in range(max_retries):
-                try:
-                    response = self.model.generate_content(
-                        prompt,
-                        generation_config=generation_config,
-                        safety_settings=self.safety_settings
-                    )
-                    break
-                except Exception as e:
-                    if "429" in str(e) or "Resource exhausted" in str(e):
-                        if attempt < max_retries - 1:
-                            print(f"  ⚠️ Rate limit hit, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries})")
-                            import time
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                            continue
-                    raise
+            consolidated = await self._generate_text(prompt, self._consolidate_gen_config,
+                                               semantic_text=combined_content,
+                                               fund_name=fund_name, model=model, cache_prompt=cache_prompt)
             
-            if response.candidates and response.candidates[0].finish_reason == 1:  # STOP
-                consolidated = response.text.strip()
+            if consolidated is not None:
                 
                 # Check if LLM gave a "ready" response
                 if "ready" in consolidated.lower() or "please provide" in consolidated.lower() or len(consolidated) < 200:
-                    print(f"  ⚠️ LLM returned 'ready' response. Using fallback consolidation.")
+                    logger.info(f"  ⚠️ LLM returned 'ready' response. Using fallback consolidation.")
                     return self._fallback_consolidate_content(source_contents)
                 
                 return consolidated
             else:
-                print(f"  ⚠️ LLM response blocked for content consolidation")
+                logger.info(f"  ⚠️ LLM response blocked for content consolidation")
                 return self._fallback_consolidate_content(source_contents)
                 
+        except LookupError:
+            raise  # replay policy: a cache miss must stop the run, not fall back to regex output
         except Exception as e:
-            print(f"  ⚠️ Error consolidating content with LLM: {e}")
+            logger.info(f"  ⚠️ Error consolidating content with LLM: {e}")
             return self._fallback_consolidate_content(source_contents)
     
+    @staticmethod
+    def _interleave_sources(main_content: str, source_contents: List[Dict[str, Any]]):
+        """Yield the consolidation prompt's source text piece by piece"""
+        yield main_content
+        for src in source_contents:
+            yield "\n\n"
+            yield f"=== {src['title']} ({src['type']}) ===\n{src['content']}"
+    
     def _fallback_consolidate_content(self, source_contents: List[Dict[str, Any]]) -> str:
-        """Fallback content consolidation if LLM fails"""
-        import re
+        """Fallback content consolidation if LLM fails
+        
+        Drops near-duplicate paragraphs (e.g. the same text in SID, KIM and factsheet) with
+        MinHash LSH when datasketch is installed, otherwise exact duplicates after normalization.
+        """
+        try:
+            from datasketch import MinHash, MinHashLSH
+            lsh = MinHashLSH(threshold=0.85, num_perm=64)
+        except ImportError:
+            lsh = None
         
         seen_paragraphs = set()
         consolidated_parts = []
@@ -379,7 +913,7 @@ CRITICAL:
         for src in source_contents:
             content = src['content']
             # Split into paragraphs
-            paragraphs = re.split(r'\n{2,}', content)
+            paragraphs = _PARAGRAPH_SPLIT_RE.split(content)
             
             for para in paragraphs:
                 para = para.strip()
@@ -387,49 +921,160 @@ CRITICAL:
                     continue
                 
                 # Normalize for duplicate detection
-                normalized = re.sub(r'\s+', ' ', para.lower())
-                normalized = re.sub(r'[^\w\s]', '', normalized)
+                normalized = _PUNCT_RE.sub('', ' '.join(para.lower().split()))
                 
                 # Skip navigation/footer noise
-                if any(word in normalized for word in ['click here', 'follow us', 'careers', 'contact us', 'home', 'statutory disclosures']):
+                if _contains_noise(normalized):
                     continue
                 
                 # Check for duplicates
-                if normalized not in seen_paragraphs and len(normalized) > 50:
-                    consolidated_parts.append(para)
-                    seen_paragraphs.add(normalized)
+                if len(normalized) <= 50 or normalized in seen_paragraphs:
+                    continue
+                if lsh is not None:
+                    minhash = MinHash(num_perm=64)
+                    minhash.update_batch([token.encode('utf-8') for token in normalized.split()])
+                    if lsh.query(minhash):
+                        continue
+                    lsh.insert(str(len(consolidated_parts)), minhash)
+                consolidated_parts.append(para)
+                seen_paragraphs.add(normalized)
         
         return '\n\n'.join(consolidated_parts)
     
-    def consolidate_scheme(self, fund_tag: str, fund_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Consolidate one scheme using LLM"""
+    async def _create_fund_context(self, fund_name: str, fund_data: Dict[str, Any],
+                                   need_metrics: bool = True) -> Optional[Dict[str, Any]]:
+        """Upload the fund's source text as Gemini cached content (when context_cache is on)
+        
+        Returns {'cached_content', 'model', 'source_text', 'shared_hashes'}, or None to send full prompts - caching
+        is off, the text is under the API minimum, the responses are already cached, or it failed.
+        """
+        if not self._context_cache_enabled():
+            return None
+        metrics_prompt, source_text = self._metrics_prompt(fund_name, fund_data)
+        if len(source_text) < self.context_cache_min_chars:
+            return None
+        
+        # Nothing to save if every response this fund needs is already cached
+        full_prompts = [(self._consolidate_gen_config,
+                         "".join([_CONSOLIDATE_PROMPT_HEAD, fund_name, _SOURCE_DOCUMENTS_HEADER, source_text,
+                                  _CONSOLIDATE_PROMPT_MIDDLE, fund_name, _CONSOLIDATE_PROMPT_TAIL]))]
+        if need_metrics:
+            full_prompts.append((self._metrics_gen_config, metrics_prompt))
+        if all(self.cache.get(ResponseCache.make_key(self.model.model_name, config, prompt)) is not None
+               for config, prompt in full_prompts):
+            return None
+        
+        context = await self._upload_context(source_text)
+        if context is not None:
+            logger.info(f"  ✓ Cached {len(source_text)} chars of source context")
+        return context
+    
+    def _context_cache_enabled(self) -> bool:
+        """Cached contexts only pay off for live interactive requests"""
+        return bool(self.context_cache) and self.mode != 'batch' and self.cache.policy != 'replay'
+    
+    async def _upload_context(self, source_text: str,
+                              shared_hashes: frozenset = frozenset()) -> Optional[Dict[str, Any]]:
+        """Create Gemini cached content holding source_text; None if the API refuses"""
+        try:
+            cached_content = await asyncio.to_thread(
+                genai.caching.CachedContent.create,
+                model=self.model.model_name,
+                system_instruction=_CONTEXT_SYSTEM_INSTRUCTION,
+                contents=[_SOURCE_DOCUMENTS_HEADER.lstrip() + source_text],
+                ttl=timedelta(hours=1)
+            )
+            model = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+        except Exception as e:
+            logger.info(f"  ⚠️ Context caching unavailable ({e}). Sending full prompts.")
+            return None
+        return {'cached_content': cached_content, 'model': model, 'source_text': source_text,
+                'shared_hashes': shared_hashes}
+    
+    async def _create_shared_contexts(self, funds: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Upload documents that several funds cite (scheme-wide SID/KIM, AMC pages) once
+        
+        A request can reference a single cached content, so funds are grouped by the exact set
+        of shared documents they cite and each group gets one context. Returns fund_tag -> context.
+        """
+        fund_hashes = {fund_tag: dict(self._unique_sources(fund_data)) for fund_tag, fund_data in funds.items()}
+        counts = {}
+        for sources in fund_hashes.values():
+            for digest in sources:
+                counts[digest] = counts.get(digest, 0) + 1
+        
+        groups = {}
+        for fund_tag, sources in fund_hashes.items():
+            shared = frozenset(digest for digest in sources if counts[digest] > 1)
+            if shared:
+                groups.setdefault(shared, []).append(fund_tag)
+        
+        contexts = {}
+        for shared, fund_tags in groups.items():
+            if len(fund_tags) < 2:
+                continue
+            sources = fund_hashes[fund_tags[0]]
+            source_text = "\n\n".join(self._source_block(sources[digest]) for digest in sources if digest in shared)
+            if len(source_text) < self.context_cache_min_chars:
+                continue
+            context = await self._upload_context(source_text, shared)
+            if context is None:
+                break
+            logger.info(f"  ✓ Cached {len(shared)} shared source(s), {len(source_text)} chars, "
+                        f"for {len(fund_tags)} funds")
+            for fund_tag in fund_tags:
+                contexts[fund_tag] = context
+        return contexts
+    
+    @staticmethod
+    async def _delete_context(context: Dict[str, Any]):
+        """Free cached content now rather than paying storage until its TTL"""
+        try:
+            await asyncio.to_thread(context['cached_content'].delete)
+        except Exception as e:
+            logger.info(f"  ⚠️ Could not delete cached context (expires with its TTL): {e}")
+    
+    async def consolidate_scheme(self, fund_tag: str, fund_data: Dict[str, Any],
+                                 metrics: Optional[Dict[str, Any]] = None,
+                                 shared_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Consolidate one scheme using LLM (metrics: already extracted by a batched request;
+        shared_context: cached sources this fund shares with others, owned by the caller)"""
         fund_name = fund_data.get('fund_name', '')
         sources = fund_data.get('sources', [])
         
-        print(f"\n{'='*80}")
-        print(f"Processing: {fund_name} ({fund_tag})")
-        print(f"{'='*80}")
-        print(f"  Sources: {len(sources)}")
+        logger.info(f"\n{'='*80}\nProcessing: {fund_name} ({fund_tag})\n{'='*80}\n  Sources: {len(sources)}")
         
-        # Extract metrics using LLM
-        print(f"\n  Step 1: Extracting metrics with LLM...")
-        metrics = self.extract_metrics_with_llm(fund_name, fund_data)
-        print(f"  ✓ Extracted metrics: {list(metrics.keys())}")
+        context = shared_context
+        if context is None:
+            context = await self._create_fund_context(fund_name, fund_data, need_metrics=metrics is None)
+        try:
+            if metrics is not None:
+                logger.info(f"\n  Consolidating content with LLM (metrics from batched extraction)...")
+                consolidated_content = await self.consolidate_content_with_llm(fund_name, fund_data, context)
+            else:
+                # Extract metrics and consolidate content - independent calls, so run them together
+                logger.info(f"\n  Extracting metrics and consolidating content with LLM...")
+                metrics, consolidated_content = await asyncio.gather(
+                    self.extract_metrics_with_llm(fund_name, fund_data, context),
+                    self.consolidate_content_with_llm(fund_name, fund_data, context)
+                )
+        finally:
+            if context is not None and context is not shared_context:
+                await self._delete_context(context)
+        metrics = sanitize_metrics(metrics)
+        lines = [f"  ✓ Extracted metrics for {fund_tag}: {list(metrics.keys())}"]
         for key, value in metrics.items():
             if value:
                 if isinstance(value, list):
-                    print(f"    - {key}: {value}")
+                    lines.append(f"    - {key}: {value}")
                 else:
                     val_str = str(value)
                     if len(val_str) > 100:
-                        print(f"    - {key}: {val_str[:100]}...")
+                        lines.append(f"    - {key}: {val_str[:100]}...")
                     else:
-                        print(f"    - {key}: {val_str}")
-        
-        # Consolidate content using LLM
-        print(f"\n  Step 2: Consolidating content with LLM...")
-        consolidated_content = self.consolidate_content_with_llm(fund_name, fund_data)
-        print(f"  ✓ Consolidated content: {len(consolidated_content)} chars")
+                        lines.append(f"    - {key}: {val_str}")
+        lines.append(f"  ✓ Consolidated content for {fund_tag}: {len(consolidated_content)} chars")
+        logger.info("\n".join(lines))
         
         # Prepare source metadata (without content)
         source_metadata = []
@@ -451,104 +1096,264 @@ CRITICAL:
             'last_updated': fund_data.get('last_updated', datetime.now().isoformat())
         }
     
+    def _run_batch_jobs(self, funds: Dict[str, Any]):
+        """Send every prompt the run needs (minus cached ones) as Batch API jobs, one per kind
+        
+        Responses are kept for _generate_text, so the per-fund pass afterwards only calls the
+        model interactively for prompts a job did not answer.
+        """
+        try:
+            from google import genai as genai_client
+        except ImportError:
+            logger.info("⚠️ Batch mode needs google-genai (pip install google-genai). Using interactive calls.")
+            return
+        
+        requests_by_kind = {'metrics': [], 'consolidate': []}
+        
+        def add_request(kind, prompt, generation_config):
+            cache_key = ResponseCache.make_key(self.model.model_name, generation_config, prompt)
+            if self.cache.get(cache_key) is None:
+                requests_by_kind[kind].append((cache_key, prompt, generation_config))
+        
+        if self.metrics_batch_size > 1:
+            for batch in self._metrics_batches(funds):
+                add_request('metrics', *self._metrics_batch_prompt(batch))
+        else:
+            for fund_data in funds.values():
+                add_request('metrics', self._metrics_prompt(fund_data.get('fund_name', ''), fund_data)[0],
+                            self._metrics_gen_config)
+        for fund_data in funds.values():
+            add_request('consolidate', self._consolidate_prompt(fund_data.get('fund_name', ''), fund_data)[0],
+                        self._consolidate_gen_config)
+        
+        client = genai_client.Client(api_key=self.api_key)
+        safety_settings = [{'category': category.name, 'threshold': threshold.name}
+                           for category, threshold in self.safety_settings.items()]
+        jobs = {}
+        for kind, requests in requests_by_kind.items():
+            if not requests:
+                continue
+            jobs[kind] = client.batches.create(
+                model=self.model.model_name,
+                src=[{
+                    'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+                    'config': {**generation_config, 'safety_settings': safety_settings},
+                } for _, prompt, generation_config in requests],
+                config={'display_name': f'scheme-consolidation-{kind}'}
+            )
+            logger.info(f"✓ Submitted {len(requests)} {kind} prompts as batch job {jobs[kind].name}")
+        
+        deadline = time.monotonic() + self.batch_timeout
+        finished = ('JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED')
+        for kind, job in jobs.items():
+            while job.state.name not in finished and time.monotonic() < deadline:
+                time.sleep(self.batch_poll_interval)
+                job = client.batches.get(name=job.name)
+            if job.state.name != 'JOB_STATE_SUCCEEDED':
+                logger.info(f"⚠️ Batch job {job.name} ended as {job.state.name}. Its prompts will be sent interactively.")
+                if job.state.name not in finished:
+                    client.batches.cancel(name=job.name)
+                continue
+            
+            answered = 0
+            for (cache_key, _, _), inlined in zip(requests_by_kind[kind], job.dest.inlined_responses):
+                response = inlined.response
+                if inlined.error or not response or not response.candidates:
+                    continue
+                if getattr(response.candidates[0].finish_reason, 'name', None) != 'STOP':
+                    continue
+                text = response.text.strip()
+                self._batch_responses[cache_key] = text
+                self.cache.put(cache_key, text)
+                answered += 1
+            logger.info(f"✓ Batch job {job.name}: {answered}/{len(requests_by_kind[kind])} responses")
+    
+    @staticmethod
+    def _original_scheme(fund_tag: str, fund_data: Dict[str, Any]) -> Dict[str, Any]:
+        """The fund's original data in the output shape (used when consolidation fails)"""
+        return {
+            'fund_name': fund_data.get('fund_name', ''),
+            'scheme_tag': fund_tag,
+            'content': fund_data.get('content', ''),
+            'metrics': sanitize_metrics(fund_data.get('metrics', {})),
+            'sources': [{
+                'source_id': s.get('source_id', ''),
+                'source_title': s.get('source_title', ''),
+                'source_type': s.get('source_type', ''),
+                'url': s.get('url', ''),
+                'authority': s.get('authority', '')
+            } for s in fund_data.get('sources', [])],
+            'last_updated': fund_data.get('last_updated', '')
+        }
+    
+    async def _consolidate_funds(self, fund_items: Iterable[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+        """Consolidate funds concurrently as they are read; a fund that fails keeps its original data
+        
+        fund_items may be a lazy stream - each fund starts as soon as it has been parsed.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        # Batched metrics and shared contexts need every fund up front
+        share_sources = self._context_cache_enabled()
+        if self.metrics_batch_size > 1 or share_sources:
+            funds = dict(fund_items)
+            fund_items = funds.items()
+        
+        # Documents cited by several funds are uploaded once as a shared cached context
+        shared_contexts = await self._create_shared_contexts(funds) if share_sources else {}
+        
+        # Optionally extract metrics several funds per request first
+        batched_metrics = {}
+        if self.metrics_batch_size > 1:
+            async def bounded_batch(batch):
+                async with semaphore:
+                    logger.info(f"\n  Extracting metrics for {len(batch)} funds in one request...")
+                    return await self.extract_metrics_batch(batch)
+            
+            for result in await asyncio.gather(*(bounded_batch(batch) for batch in self._metrics_batches(funds))):
+                batched_metrics.update(result)
+            logger.info(f"  ✓ Batched metrics for {len(batched_metrics)}/{len(funds)} funds")
+        
+        async def bounded(fund_tag, fund_data):
+            async with semaphore:
+                try:
+                    return await self.consolidate_scheme(fund_tag, fund_data, batched_metrics.get(fund_tag),
+                                                         shared_contexts.get(fund_tag))
+                except LookupError:
+                    raise  # replay cache miss
+                except Exception as e:
+                    logger.info(f"\n  ❌ Error processing {fund_tag}: {e}")
+                    # Keep original data as fallback
+                    return self._original_scheme(fund_tag, fund_data)
+        
+        tasks = {}
+        for fund_tag, fund_data in fund_items:
+            tasks[fund_tag] = asyncio.create_task(bounded(fund_tag, fund_data))
+            await asyncio.sleep(0)  # let started funds send their requests before parsing the next one
+        try:
+            results = await asyncio.gather(*tasks.values())
+        finally:
+            for context in {id(context): context for context in shared_contexts.values()}.values():
+                await self._delete_context(context)
+        return dict(zip(tasks.keys(), results))
+    
+    def _read_knowledge_base(self, input_file: str) -> Tuple[Dict[str, Any], Iterable[Tuple[str, Dict[str, Any]]]]:
+        """Return (top-level sections other than funds, (fund_tag, fund_data) pairs)
+        
+        With ijson the file is read in a single pass: funds are yielded one at a time and the other
+        sections are filled in as they are reached, so read them only after the funds are consumed.
+        """
+        if ijson is not None:
+            sections = {}
+            fund_items = _stream_json_sections(input_file, 'funds', sections)
+        else:
+            sections = _load_json(input_file)
+            fund_items = sections.get('funds', {}).items()
+        return sections, self._with_consolidated_content(fund_items)
+    
+    @staticmethod
+    def _load_consolidated_overrides() -> Dict[str, Tuple[str, Optional[Dict[str, Any]]]]:
+        """fund_tag -> (content, metrics) from consolidated_scheme_data.json ({} if it's missing)"""
+        logger.info("  Sources don't have content. Trying consolidated_scheme_data.json...")
+        try:
+            # Keep only what gets merged (content and metrics) for each fund
+            if ijson is not None:
+                consolidated_funds = _iter_json_items('consolidated_scheme_data.json', 'funds')
+            else:
+                consolidated_funds = _load_json('consolidated_scheme_data.json').get('funds', {}).items()
+            overrides = {fund_tag: (consolidated_fund.get('content', ''), consolidated_fund.get('metrics'))
+                         for fund_tag, consolidated_fund in consolidated_funds}
+            logger.info("  ✓ Loaded content from consolidated_scheme_data.json")
+            return overrides
+        except FileNotFoundError:
+            logger.info("  ⚠️ consolidated_scheme_data.json not found. Using available content.")
+            return {}
+    
+    def _with_consolidated_content(self, fund_items: Iterable[Tuple[str, Dict[str, Any]]]) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        """Give each fund whose sources carry no content the content/metrics from consolidated_scheme_data.json"""
+        overrides = None
+        for fund_tag, fund_data in fund_items:
+            if not any(source.get('content') for source in fund_data.get('sources', [])):
+                if overrides is None:
+                    overrides = self._load_consolidated_overrides()  # read once, on the first fund that needs it
+                if fund_tag in overrides:
+                    content, metrics = overrides[fund_tag]
+                    fund_data['content'] = content
+                    # Also merge any existing metrics
+                    if metrics:
+                        fund_data.setdefault('metrics', {}).update(metrics)
+            yield fund_tag, fund_data
+    
     def consolidate_all(self, input_file: str, output_file: str):
         """Consolidate all schemes using LLM"""
-        print("="*80)
-        print("LLM-BASED SCHEME CONSOLIDATION")
-        print("="*80)
+        try:
+            return self._consolidate_all(input_file, output_file)
+        finally:
+            _flush_log_listener()
+    
+    def _consolidate_all(self, input_file: str, output_file: str):
+        logger.info("="*80 + "\nLLM-BASED SCHEME CONSOLIDATION\n" + "="*80)
         
-        print("\nLoading knowledge base...")
-        with open(input_file, 'r', encoding='utf-8') as f:
-            kb = json.load(f)
+        logger.info("\nLoading knowledge base...")
+        kb, fund_items = self._read_knowledge_base(input_file)
+        consolidated_at = datetime.now().isoformat()
         
-        # If input file doesn't have content in sources, try to use consolidated_scheme_data.json
-        if not any(source.get('content') for fund in kb.get('funds', {}).values() for source in fund.get('sources', [])):
-            print("  Sources don't have content. Trying consolidated_scheme_data.json...")
-            try:
-                with open('consolidated_scheme_data.json', 'r', encoding='utf-8') as f:
-                    consolidated_data = json.load(f)
-                    # Merge content from consolidated data
-                    for fund_tag, consolidated_fund in consolidated_data.get('funds', {}).items():
-                        if fund_tag in kb.get('funds', {}):
-                            kb['funds'][fund_tag]['content'] = consolidated_fund.get('content', '')
-                            # Also merge any existing metrics
-                            if consolidated_fund.get('metrics'):
-                                kb['funds'][fund_tag].setdefault('metrics', {}).update(consolidated_fund['metrics'])
-                print("  ✓ Loaded content from consolidated_scheme_data.json")
-            except FileNotFoundError:
-                print("  ⚠️ consolidated_scheme_data.json not found. Using available content.")
+        if self.mode == 'batch' and self.cache.policy != 'replay':
+            # Batch jobs are submitted for every fund up front
+            funds = dict(fund_items)
+            fund_items = funds.items()
+            logger.info(f"✓ Loaded knowledge base with {len(funds)} funds")
+            logger.info("\nRunning batch jobs (this can take a while)...")
+            self._run_batch_jobs(funds)
         
+        # Process funds concurrently as they are read (bounded by max_concurrency)
+        funds = asyncio.run(self._consolidate_funds(fund_items))
+        
+        # kb's other sections are complete once the funds stream has been consumed
         consolidated = {
             'metadata': {
                 'created_at': kb.get('metadata', {}).get('created_at', ''),
                 'version': '4.0',
                 'description': 'LLM-consolidated scheme data - Single source of truth per scheme with intelligent metric extraction',
-                'consolidated_at': datetime.now().isoformat()
+                'consolidated_at': consolidated_at
             },
-            'funds': {},
+            'funds': funds,
             'regulatory': kb.get('regulatory', {}),
             'help': kb.get('help', {})
         }
         
-        print(f"✓ Loaded knowledge base with {len(kb.get('funds', {}))} funds")
-        
-        # Process each fund
-        for fund_tag, fund_data in kb.get('funds', {}).items():
-            try:
-                consolidated_scheme = self.consolidate_scheme(fund_tag, fund_data)
-                consolidated['funds'][fund_tag] = consolidated_scheme
-            except Exception as e:
-                print(f"\n  ❌ Error processing {fund_tag}: {e}")
-                # Keep original data as fallback
-                consolidated['funds'][fund_tag] = {
-                    'fund_name': fund_data.get('fund_name', ''),
-                    'scheme_tag': fund_tag,
-                    'content': fund_data.get('content', ''),
-                    'metrics': fund_data.get('metrics', {}),
-                    'sources': [{
-                        'source_id': s.get('source_id', ''),
-                        'source_title': s.get('source_title', ''),
-                        'source_type': s.get('source_type', ''),
-                        'url': s.get('url', ''),
-                        'authority': s.get('authority', '')
-                    } for s in fund_data.get('sources', [])],
-                    'last_updated': fund_data.get('last_updated', '')
-                }
-        
-        print("\n" + "="*80)
-        print("Saving consolidated knowledge base...")
-        print("="*80)
+        logger.info("\n" + "="*80 + "\nSaving consolidated knowledge base...\n" + "="*80)
         
         # Backup original file
         backup_file = input_file.replace('.json', '.backup.json')
         if os.path.exists(input_file):
             import shutil
             shutil.copy2(input_file, backup_file)
-            print(f"✓ Backed up original to {backup_file}")
+            logger.info(f"✓ Backed up original to {backup_file}")
         
         # Save consolidated data
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(consolidated, f, indent=2, ensure_ascii=False)
+        _dump_json(consolidated, output_file)
         
-        print(f"✓ Saved to {output_file}")
+        logger.info(f"✓ Saved to {output_file}")
         
-        # Print summary
-        print("\n" + "="*80)
-        print("CONSOLIDATION SUMMARY")
-        print("="*80)
-        print(f"Total schemes: {len(consolidated['funds'])}")
+        # Print summary (one log record)
+        lines = ["\n" + "="*80, "CONSOLIDATION SUMMARY", "="*80, f"Total schemes: {len(consolidated['funds'])}"]
         for fund_tag, scheme in consolidated['funds'].items():
-            print(f"\n{fund_tag}: {scheme['fund_name']}")
-            print(f"  Content: {len(scheme['content'])} chars")
-            print(f"  Sources: {len(scheme['sources'])}")
-            print(f"  Metrics: {len(scheme['metrics'])} fields")
+            lines.append(f"\n{fund_tag}: {scheme['fund_name']}")
+            lines.append(f"  Content: {len(scheme['content'])} chars")
+            lines.append(f"  Sources: {len(scheme['sources'])}")
+            lines.append(f"  Metrics: {len(scheme['metrics'])} fields")
             if scheme['metrics']:
-                print(f"    Fields: {', '.join(scheme['metrics'].keys())}")
+                lines.append(f"    Fields: {', '.join(scheme['metrics'].keys())}")
+        
+        if self.semantic_cache and self.semantic_cache.lookups:
+            lines.append(f"\nSemantic cache: {self.semantic_cache.hits}/{self.semantic_cache.lookups} hits")
+        logger.info("\n".join(lines))
         
         return consolidated
 
 if __name__ == '__main__':
-    consolidator = LLMSchemeConsolidator()
+    consolidator = LLMSchemeConsolidator(max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '8')))
     consolidated = consolidator.consolidate_all(
         'cleaned_knowledge_base.json',
         'cleaned_knowledge_base.json'
@@ -5,17 +5,90 @@ Supports: Ollama, Hugging Face Transformers, OpenAI, Anthropic
 No rate limits when using local models (Ollama/Hugging Face)
 """
 
+import hashlib
 import json
 import os
-from typing import Dict, List, Any, Optional
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
 
+from _consolidation_utils import bounded_concat, extract_first_json_object, sanitize_metrics
+
 # Load environment variables
 load_dotenv()
 
+# JSON schema for metric extraction. Backends that support constrained decoding
+# (Ollama structured outputs, Gemini JSON mode, OpenAI JSON mode, Hugging Face via outlines)
+# only emit tokens that are valid for this shape, so no prose or ```json fences come back.
+_NULLABLE_STRING = {"type": ["string", "null"]}
+METRICS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "expense_ratio": _NULLABLE_STRING,
+        "benchmark": _NULLABLE_STRING,
+        "nav": _NULLABLE_STRING,
+        "aum": _NULLABLE_STRING,
+        "exit_load": _NULLABLE_STRING,
+        "riskometer": _NULLABLE_STRING,
+        "investment_objective": _NULLABLE_STRING,
+        "returns": {"type": ["array", "null"], "items": {"type": "string"}},
+        "inception_date": _NULLABLE_STRING,
+        "fund_manager": _NULLABLE_STRING,
+        "min_investment": _NULLABLE_STRING,
+        "lock_in_period": _NULLABLE_STRING,
+    },
+}
+
+# Retrieval queries used when only the most relevant source chunks are sent to the LLM
+METRICS_RETRIEVAL_QUERIES = [
+    "total expense ratio TER AUM assets under management NAV benchmark index",
+    "exit load riskometer risk level lock-in period minimum investment amount",
+    "investment objective fund manager inception date returns performance",
+]
+CONSOLIDATION_RETRIEVAL_QUERIES = [
+    "investment objective exit load fund manager",
+    "investment strategy asset allocation key scheme features",
+]
+
+def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
+    """Split text into fixed-size overlapping chunks for retrieval"""
+    chunks = []
+    step = chunk_size - overlap
+    for start in range(0, max(len(text) - overlap, 1), step):
+        chunk = text[start:start + chunk_size]
+        if chunk.strip():
+            chunks.append(chunk)
+    return chunks
+
+def _has_significant_content(text: str, min_chars: int = 50) -> bool:
+    """Same as len(text.strip()) > min_chars, without allocating a stripped copy"""
+    if len(text) <= min_chars:
+        return False
+    start, end = 0, len(text)
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end - start > min_chars
+
+# Per-process consolidator used by ProcessPoolExecutor workers (see consolidate_all)
+_worker_consolidator = None
+
+def _init_worker(consolidator_kwargs: Dict[str, Any]):
+    """Create this worker's own consolidator (and LLM client)"""
+    global _worker_consolidator
+    _worker_consolidator = LLMSchemeConsolidator(**consolidator_kwargs)
+
+def _consolidate_scheme_worker(fund_tag: str, fund_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Picklable entry point that consolidates one fund in a worker process"""
+    return _worker_consolidator.consolidate_scheme(fund_tag, fund_data)
+
 class LLMSchemeConsolidator:
-    def __init__(self, model_type: str = "ollama", model_name: str = "llama3.1:8b", api_key: Optional[str] = None):
+    def __init__(self, model_type: str = "ollama", model_name: str = "llama3.1:8b", api_key: Optional[str] = None,
+                 retrieval_top_k: Optional[int] = None, embedding_model_name: str = "all-MiniLM-L6-v2",
+                 embedding_cache_file: Optional[str] = None):
         """
         Initialize LLM consolidator
         
@@ -23,11 +96,32 @@ class LLMSchemeConsolidator:
             model_type: "ollama", "huggingface", "openai", "anthropic", "gemini"
             model_name: Model name (e.g., "llama3.1:8b" for Ollama, "mistralai/Mistral-7B-Instruct-v0.2" for HF)
             api_key: API key (only needed for cloud models)
+            retrieval_top_k: If set, embed source chunks and send only the top-k chunks
+                relevant to each task instead of the full (truncated) sources
+            embedding_model_name: Sentence-transformers model used for retrieval
+            embedding_cache_file: .npz file keeping source embeddings between runs
+                (defaults to one beside the input knowledge base)
         """
         self.model_type = model_type.lower()
         self.model_name = model_name
         self.api_key = api_key
         self.model = None
+        self.retrieval_top_k = retrieval_top_k
+        self.embedding_model_name = embedding_model_name
+        self._embedding_model = None
+        self.embedding_cache_file = embedding_cache_file
+        self._embedding_cache = None  # sha1(text) -> normalized embedding, loaded on first use
+        self._outlines_model = None  # Hugging Face model wrapped for outlines (if installed)
+        self._json_generators = {}  # (schema, temperature) -> outlines JSON generator
+        # Everything a worker process needs to build an equivalent consolidator
+        self._init_kwargs = {
+            'model_type': model_type,
+            'model_name': model_name,
+            'api_key': api_key,
+            'retrieval_top_k': retrieval_top_k,
+            'embedding_model_name': embedding_model_name,
+            'embedding_cache_file': embedding_cache_file
+        }
         self._initialize_model()
     
     def _initialize_model(self):
@@ -64,6 +158,12 @@ class LLMSchemeConsolidator:
             except ImportError:
                 print("⚠️  Transformers not installed. Install with: pip install transformers torch")
                 raise
+            try:
+                import outlines  # Optional: JSON-constrained generation for metric extraction
+                self._outlines_model = outlines.models.Transformers(self.model.model, self.model.tokenizer)
+                print("  ✓ outlines available - metrics output constrained to the JSON schema")
+            except ImportError:
+                pass
         
         elif self.model_type == "openai":
             try:
@@ -95,12 +195,20 @@ class LLMSchemeConsolidator:
         elif self.model_type == "gemini":
             try:
                 import google.generativeai as genai
+                from google.generativeai.types import HarmCategory, HarmBlockThreshold
                 if not self.api_key:
                     self.api_key = os.getenv('GEMINI_API_KEY')
                 if not self.api_key:
                     raise ValueError("Gemini API key required. Set GEMINI_API_KEY environment variable.")
                 genai.configure(api_key=self.api_key)
                 self.model = genai.GenerativeModel(self.model_name)
+                # Safety settings are constant, so build them once instead of per call
+                self.safety_settings = {
+                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+                }
                 print(f"✓ Using Gemini with model: {self.model_name}")
             except ImportError:
                 print("⚠️  Google Generative AI not installed. Install with: pip install google-generativeai")
@@ -108,16 +216,23 @@ class LLMSchemeConsolidator:
         else:
             raise ValueError(f"Unknown model_type: {self.model_type}. Use: ollama, huggingface, openai, anthropic, or gemini")
     
-    def _call_llm(self, prompt: str, max_tokens: int = 2000, temperature: float = 0.1) -> str:
-        """Call the appropriate LLM API"""
+    def _call_llm(self, prompt: str, max_tokens: int = 2000, temperature: float = 0.1,
+                  json_schema: Optional[Dict[str, Any]] = None) -> str:
+        """Call the appropriate LLM API
+        
+        If json_schema is given, backends with constrained decoding are asked to
+        return JSON matching it. Other backends ignore it and return free text.
+        """
         if self.model_type == "ollama":
+            extra_args = {"format": json_schema} if json_schema else {}
             response = self.model.generate(
                 model=self.model_name,
                 prompt=prompt,
                 options={
                     "temperature": temperature,
                     "num_predict": max_tokens
-                }
+                },
+                **extra_args
             )
             # Ollama returns the response directly in the 'response' field
             if isinstance(response, dict):
@@ -128,6 +243,9 @@ class LLMSchemeConsolidator:
         elif self.model_type == "huggingface":
             # For Hugging Face, we need to format the prompt properly
             formatted_prompt = f"<|system|>You are a helpful assistant.<|user|>{prompt}<|assistant|>"
+            if json_schema and self._outlines_model is not None:
+                generator = self._hf_json_generator(json_schema, temperature)
+                return json.dumps(generator(formatted_prompt, max_tokens=max_tokens))
             result = self.model(
                 formatted_prompt,
                 max_new_tokens=max_tokens,
@@ -138,6 +256,7 @@ class LLMSchemeConsolidator:
             return result[0]['generated_text'].strip()
         
         elif self.model_type == "openai":
+            extra_args = {"response_format": {"type": "json_object"}} if json_schema else {}
             response = self.model.ChatCompletion.create(
                 model=self.model_name,
                 messages=[
@@ -145,7 +264,8 @@ class LLMSchemeConsolidator:
                     {"role": "user", "content": prompt}
                 ],
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                **extra_args
             )
             return response.choices[0].message.content.strip()
         
@@ -161,50 +281,145 @@ class LLMSchemeConsolidator:
             return response.content[0].text.strip()
         
         elif self.model_type == "gemini":
-            from google.generativeai.types import HarmCategory, HarmBlockThreshold
+            generation_config = {
+                "temperature": temperature,
+                "max_output_tokens": max_tokens,
+            }
+            if json_schema:
+                generation_config["response_mime_type"] = "application/json"
             response = self.model.generate_content(
                 prompt,
-                generation_config={
-                    "temperature": temperature,
-                    "max_output_tokens": max_tokens,
-                },
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
+                generation_config=generation_config,
+                safety_settings=self.safety_settings
             )
             if response.candidates and response.candidates[0].finish_reason == 1:
                 return response.text.strip()
             else:
                 raise ValueError("Gemini response blocked")
     
-    def extract_metrics_with_llm(self, fund_name: str, fund_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Use LLM to extract structured metrics from all sources"""
+    def _hf_json_generator(self, json_schema: Dict[str, Any], temperature: float):
+        """outlines generator that only samples JSON matching json_schema (built once per schema)"""
+        import outlines
+        key = (json.dumps(json_schema, sort_keys=True), temperature)
+        if key not in self._json_generators:
+            sampler = (outlines.samplers.greedy() if temperature == 0
+                       else outlines.samplers.multinomial(temperature=temperature))
+            self._json_generators[key] = outlines.generate.json(self._outlines_model, key[0], sampler=sampler)
+        return self._json_generators[key]
+    
+    def _load_embedding_cache(self) -> Dict[str, Any]:
+        """Read the on-disk embedding cache (empty if there is none or it cannot be read)"""
+        import numpy as np
         
-        # Get content from the main content field
-        main_content = fund_data.get('content', '')
+        if not self.embedding_cache_file or not os.path.exists(self.embedding_cache_file):
+            return {}
+        try:
+            with np.load(self.embedding_cache_file) as cached:
+                return {key: cached[key] for key in cached.files}
+        except Exception as e:
+            print(f"  ⚠ Ignoring unreadable embedding cache {self.embedding_cache_file}: {e}")
+            return {}
+    
+    def _save_embedding_cache(self):
+        """Merge the in-memory embeddings into the on-disk cache
         
-        # Also try to get content from sources if available
-        source_contents = []
+        Worker processes save independently, so entries written by others since this
+        process loaded the cache are kept, and the file is replaced atomically.
+        """
+        import numpy as np
+        
+        if not self.embedding_cache_file:
+            return
+        merged = self._load_embedding_cache()
+        merged.update(self._embedding_cache)
+        tmp_file = f"{self.embedding_cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, **merged)
+            os.replace(tmp_file, self.embedding_cache_file)
+        except OSError as e:
+            print(f"  ⚠ Could not save embedding cache: {e}")
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    
+    def _embed_texts(self, texts: List[str]):
+        """Return normalized embeddings for texts, encoding only ones not seen before
+        (in this run or, with embedding_cache_file, an earlier one)"""
+        import numpy as np
+        
+        if self._embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+            try:
+                import torch
+                device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            except ImportError:
+                device = 'cpu'
+            print(f"  Loading embedding model {self.embedding_model_name} on {device}...")
+            self._embedding_model = SentenceTransformer(self.embedding_model_name, device=device)
+        
+        if self._embedding_cache is None:
+            self._embedding_cache = self._load_embedding_cache()
+        
+        keys = [hashlib.sha1(text.encode('utf-8')).hexdigest() for text in texts]
+        missing = {key: text for key, text in zip(keys, texts) if key not in self._embedding_cache}
+        if missing:
+            vectors = self._embedding_model.encode(
+                list(missing.values()),
+                batch_size=64,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            self._embedding_cache.update(zip(missing.keys(), vectors))
+            self._save_embedding_cache()
+        return np.stack([self._embedding_cache[key] for key in keys])
+    
+    def _retrieve_relevant_content(self, fund_data: Dict[str, Any], queries: List[str]) -> str:
+        """Join the retrieval_top_k source chunks most similar to any of the queries
+        
+        Chunks keep their original document order and are grouped under their
+        source header, so the prompt reads like a shortened version of the sources.
+        """
+        import numpy as np
+        
+        chunks = []  # (source header, chunk text)
+        for chunk in _chunk_text(fund_data.get('content', '')):
+            chunks.append(("", chunk))
         for source in fund_data.get('sources', []):
             content = source.get('content', '')
-            if content and len(content.strip()) > 50:
-                source_title = source.get('source_title', 'Unknown')
-                source_type = source.get('source_type', 'unknown')
-                truncated_content = content[:8000] if len(content) > 8000 else content
-                source_contents.append(f"=== {source_title} ({source_type}) ===\n{truncated_content}\n---END OF SOURCE---")
+            if content and _has_significant_content(content):
+                header = f"=== {source.get('source_title', 'Unknown')} ({source.get('source_type', 'unknown')}) ==="
+                for chunk in _chunk_text(content):
+                    chunks.append((header, chunk))
+        
+        if not chunks:
+            return ""
+        
+        chunk_embeddings = self._embed_texts([text for _, text in chunks])
+        query_embeddings = self._embed_texts(queries)
+        # Embeddings are normalized, so the dot product is the cosine similarity
+        scores = (chunk_embeddings @ query_embeddings.T).max(axis=1)
+        top_indices = sorted(np.argsort(-scores)[:self.retrieval_top_k])
+        
+        parts = []
+        last_header = None
+        for idx in top_indices:
+            header, text = chunks[idx]
+            if header and header != last_header:
+                parts.append(header)
+                last_header = header
+            parts.append(text)
+        return "\n\n".join(parts)
+    
+    def extract_metrics_with_llm(self, fund_name: str, fund_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Use LLM to extract structured metrics from all sources"""
         
-        # Combine main content and source contents
-        if source_contents:
-            all_content = main_content + "\n\n" + "\n\n".join(source_contents)
+        if self.retrieval_top_k:
+            # Send only the chunks relevant to the metrics we extract
+            all_content = self._retrieve_relevant_content(fund_data, METRICS_RETRIEVAL_QUERIES)
         else:
-            all_content = main_content
-        
-        # Truncate total content to ~40000 chars
-        if len(all_content) > 40000:
-            all_content = all_content[:35000] + "\n\n[... content truncated ...]\n\n" + all_content[-5000:]
+            # Main content + sources in one pass, keeping the first 35000 and last 5000 chars
+            # when the total exceeds 40000
+            all_content = bounded_concat(self._metrics_source_parts(fund_data))
         
         prompt = f"""Extract structured metrics from mutual fund documents. Return ONLY a JSON object.
 
@@ -239,22 +454,19 @@ Rules:
 Return ONLY valid JSON, no explanations."""
 
         try:
-            result_text = self._call_llm(prompt, max_tokens=2000, temperature=0.0)
-            
-            # Extract JSON from response
-            import re
-            if "```json" in result_text:
-                result_text = result_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in result_text:
-                result_text = result_text.split("```")[1].split("```")[0].strip()
+            result_text = self._call_llm(prompt, max_tokens=2000, temperature=0.0,
+                                         json_schema=METRICS_JSON_SCHEMA)
             
-            # Try to find JSON object
-            json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', result_text, re.DOTALL)
-            if json_match:
-                result_text = json_match.group(0)
+            # Constrained backends return bare JSON; free-text backends (Anthropic,
+            # Hugging Face without outlines) may wrap it in prose or code fences
+            if not result_text.lstrip().startswith('{'):
+                if "```json" in result_text:
+                    result_text = result_text.split("```json")[1].split("```")[0].strip()
+                elif "```" in result_text:
+                    result_text = result_text.split("```")[1].split("```")[0].strip()
             
             try:
-                metrics = json.loads(result_text)
+                metrics = extract_first_json_object(result_text)
                 # Filter out null values
                 filtered_metrics = {}
                 for k, v in metrics.items():
@@ -274,6 +486,18 @@ Return ONLY valid JSON, no explanations."""
             print(f"  ⚠️ Error extracting metrics: {e}")
             return {}
     
+    @staticmethod
+    def _metrics_source_parts(fund_data: Dict[str, Any]):
+        """Yield the metrics prompt's source text piece by piece"""
+        yield fund_data.get('content', '')
+        for source in fund_data.get('sources', []):
+            content = source.get('content', '')
+            if content and _has_significant_content(content):
+                source_title = source.get('source_title', 'Unknown')
+                source_type = source.get('source_type', 'unknown')
+                yield "\n\n"
+                yield f"=== {source_title} ({source_type}) ===\n{content[:8000]}\n---END OF SOURCE---"
+    
     def consolidate_content_with_llm(self, fund_name: str, fund_data: Dict[str, Any]) -> str:
         """Use LLM to consolidate content from all sources"""
         
@@ -282,7 +506,7 @@ Return ONLY valid JSON, no explanations."""
         source_contents = []
         for source in fund_data.get('sources', []):
             content = source.get('content', '')
-            if content and len(content.strip()) > 50:
+            if content and _has_significant_content(content):
                 source_type = source.get('source_type', 'unknown')
                 source_title = source.get('source_title', 'Unknown')
                 truncated_content = content[:8000] if len(content) > 8000 else content
@@ -292,16 +516,18 @@ Return ONLY valid JSON, no explanations."""
                     'content': truncated_content
                 })
         
-        if source_contents:
-            combined_content = main_content + "\n\n" + "\n\n".join([
-                f"=== {src['title']} ({src['type']}) ===\n{src['content']}"
-                for src in source_contents
-            ])
+        if self.retrieval_top_k:
+            # Send only the chunks relevant to the sections we consolidate
+            parts = [self._retrieve_relevant_content(fund_data, CONSOLIDATION_RETRIEVAL_QUERIES)]
         else:
-            combined_content = main_content
+            parts = [main_content]
+            for src in source_contents:
+                parts.append("\n\n")
+                parts.append(f"=== {src['title']} ({src['type']}) ===\n{src['content']}")
         
-        if len(combined_content) > 40000:
-            combined_content = combined_content[:40000] + "\n\n[Content truncated...]"
+        # Keep the first 40000 chars without building the full joined text
+        combined_content = bounded_concat(parts, head_budget=40000, tail_budget=0,
+                                          marker="\n\n[Content truncated...]")
         
         prompt = f"""Consolidate mutual fund information from multiple sources into one clean entry.
 
@@ -353,6 +579,17 @@ Return ONLY the consolidated content, no explanations."""
             print(f"  ⚠️ Error consolidating content: {e}")
             return main_content if main_content else ""
     
+    @staticmethod
+    def _source_metadata_only(fund_data: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Source descriptors for a fund without their (large) content"""
+        return [{
+            'source_id': source.get('source_id', ''),
+            'source_title': source.get('source_title', ''),
+            'source_type': source.get('source_type', ''),
+            'url': source.get('url', ''),
+            'authority': source.get('authority', '')
+        } for source in fund_data.get('sources', [])]
+    
     def consolidate_scheme(self, fund_tag: str, fund_data: Dict[str, Any]) -> Dict[str, Any]:
         """Consolidate one scheme using LLM"""
         fund_name = fund_data.get('fund_name', '')
@@ -365,7 +602,7 @@ Return ONLY the consolidated content, no explanations."""
         
         # Extract metrics
         print(f"\n  Step 1: Extracting metrics with {self.model_type}...")
-        metrics = self.extract_metrics_with_llm(fund_name, fund_data)
+        metrics = sanitize_metrics(self.extract_metrics_with_llm(fund_name, fund_data))
         print(f"  ✓ Extracted metrics: {list(metrics.keys())}")
         for key, value in metrics.items():
             if value:
@@ -383,28 +620,78 @@ Return ONLY the consolidated content, no explanations."""
         consolidated_content = self.consolidate_content_with_llm(fund_name, fund_data)
         print(f"  ✓ Consolidated content: {len(consolidated_content)} chars")
         
-        # Prepare source metadata
-        source_metadata = []
-        for source in sources:
-            source_metadata.append({
-                'source_id': source.get('source_id', ''),
-                'source_title': source.get('source_title', ''),
-                'source_type': source.get('source_type', ''),
-                'url': source.get('url', ''),
-                'authority': source.get('authority', '')
-            })
-        
         return {
             'fund_name': fund_name,
             'scheme_tag': fund_tag,
             'content': consolidated_content,
             'metrics': metrics,
-            'sources': source_metadata,
+            'sources': self._source_metadata_only(fund_data),
             'last_updated': fund_data.get('last_updated', datetime.now().isoformat())
         }
     
-    def consolidate_all(self, input_file: str, output_file: str):
-        """Consolidate all schemes using LLM"""
+    def _load_fund_entries(self, path: str, fund_tags) -> Dict[str, Dict[str, Any]]:
+        """Load only the content/metrics of the given funds from a knowledge base file
+        
+        Streams the 'funds' object with ijson when it is installed, so funds we don't
+        need are never held in memory. Falls back to a full json.load otherwise.
+        """
+        wanted = set(fund_tags)
+        entries = {}
+        if not wanted:
+            return entries
+        
+        try:
+            import ijson
+        except ImportError:
+            ijson = None
+        
+        with open(path, 'rb') as f:
+            if ijson:
+                funds_iter = ijson.kvitems(f, 'funds', use_float=True)
+            else:
+                funds_iter = json.load(f).get('funds', {}).items()
+            
+            for fund_tag, fund in funds_iter:
+                if fund_tag not in wanted:
+                    continue
+                entries[fund_tag] = {
+                    'content': fund.get('content', ''),
+                    'metrics': fund.get('metrics', {})
+                }
+                if len(entries) == len(wanted):
+                    break
+        
+        return entries
+    
+    def _consolidate_in_processes(self, funds: Dict[str, Dict[str, Any]], max_workers: int) -> Dict[str, Any]:
+        """Consolidate funds in worker processes sharing the LLM server
+        
+        Returns fund_tag -> consolidated scheme, or the exception raised for that fund.
+        """
+        print(f"\nProcessing {len(funds)} funds with {max_workers} worker processes...")
+        outcomes = {}
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(self._init_kwargs,)) as executor:
+            futures = {
+                executor.submit(_consolidate_scheme_worker, fund_tag, fund_data): fund_tag
+                for fund_tag, fund_data in funds.items()
+            }
+            for future in as_completed(futures):
+                fund_tag = futures[future]
+                try:
+                    outcomes[fund_tag] = future.result()
+                except Exception as e:
+                    outcomes[fund_tag] = e
+        return outcomes
+    
+    def consolidate_all(self, input_file: str, output_file: str, max_workers: Optional[int] = None):
+        """Consolidate all schemes using LLM
+        
+        With max_workers > 1, funds are processed in parallel worker processes. Each
+        worker talks to the same LLM server (Ollama or a cloud API), so prompt
+        building and response parsing overlap with generation. Hugging Face models
+        are loaded in-process and always run serially.
+        """
         print("="*80)
         print(f"LLM-BASED SCHEME CONSOLIDATION ({self.model_type.upper()})")
         print("="*80)
@@ -417,13 +704,11 @@ Return ONLY the consolidated content, no explanations."""
         if not any(source.get('content') for fund in kb.get('funds', {}).values() for source in fund.get('sources', [])):
             print("  Sources don't have content. Trying consolidated_scheme_data.json...")
             try:
-                with open('consolidated_scheme_data.json', 'r', encoding='utf-8') as f:
-                    consolidated_data = json.load(f)
-                    for fund_tag, consolidated_fund in consolidated_data.get('funds', {}).items():
-                        if fund_tag in kb.get('funds', {}):
-                            kb['funds'][fund_tag]['content'] = consolidated_fund.get('content', '')
-                            if consolidated_fund.get('metrics'):
-                                kb['funds'][fund_tag].setdefault('metrics', {}).update(consolidated_fund['metrics'])
+                fallback_funds = self._load_fund_entries('consolidated_scheme_data.json', kb.get('funds', {}).keys())
+                for fund_tag, consolidated_fund in fallback_funds.items():
+                    kb['funds'][fund_tag]['content'] = consolidated_fund.get('content', '')
+                    if consolidated_fund.get('metrics'):
+                        kb['funds'][fund_tag].setdefault('metrics', {}).update(consolidated_fund['metrics'])
                 print("  ✓ Loaded content from consolidated_scheme_data.json")
             except FileNotFoundError:
                 print("  ⚠️ consolidated_scheme_data.json not found. Using available content.")
@@ -443,28 +728,37 @@ Return ONLY the consolidated content, no explanations."""
         
         print(f"✓ Loaded knowledge base with {len(kb.get('funds', {}))} funds")
         
+        if self.retrieval_top_k and not self.embedding_cache_file:
+            # Keep source embeddings beside the knowledge base so re-runs only encode new chunks
+            self.embedding_cache_file = os.path.join(
+                os.path.dirname(os.path.abspath(input_file)),
+                f"source_embeddings_{self.embedding_model_name.replace('/', '_')}.npz")
+            self._init_kwargs['embedding_cache_file'] = self.embedding_cache_file
+        
         # Process each fund
+        outcomes = {}
+        if max_workers and max_workers > 1 and self.model_type != "huggingface":
+            outcomes = self._consolidate_in_processes(kb.get('funds', {}), max_workers)
+        
         for fund_tag, fund_data in kb.get('funds', {}).items():
             try:
-                consolidated_scheme = self.consolidate_scheme(fund_tag, fund_data)
+                if fund_tag in outcomes:
+                    consolidated_scheme = outcomes[fund_tag]
+                    if isinstance(consolidated_scheme, Exception):
+                        raise consolidated_scheme
+                else:
+                    consolidated_scheme = self.consolidate_scheme(fund_tag, fund_data)
                 consolidated['funds'][fund_tag] = consolidated_scheme
             except Exception as e:
                 print(f"\n  ❌ Error processing {fund_tag}: {e}")
-                import traceback
                 traceback.print_exc()
                 # Keep original data as fallback
                 consolidated['funds'][fund_tag] = {
                     'fund_name': fund_data.get('fund_name', ''),
                     'scheme_tag': fund_tag,
                     'content': fund_data.get('content', ''),
-                    'metrics': fund_data.get('metrics', {}),
-                    'sources': [{
-                        'source_id': s.get('source_id', ''),
-                        'source_title': s.get('source_title', ''),
-                        'source_type': s.get('source_type', ''),
-                        'url': s.get('url', ''),
-                        'authority': s.get('authority', '')
-                    } for s in fund_data.get('sources', [])],
+                    'metrics': sanitize_metrics(fund_data.get('metrics', {})),
+                    'sources': self._source_metadata_only(fund_data),
                     'last_updated': fund_data.get('last_updated', '')
                 }
         
@@ -512,17 +806,24 @@ if __name__ == '__main__':
     if len(sys.argv) > 2:
         model_name = sys.argv[2]
     
+    # Optional: send only the top-k relevant source chunks to the LLM
+    retrieval_top_k = int(os.getenv('LLM_RETRIEVAL_TOP_K', '0')) or None
+    # Optional: process funds in parallel worker processes
+    max_workers = int(os.getenv('LLM_MAX_WORKERS', '0')) or None
+    
     print(f"\nUsing {model_type} with model: {model_name}\n")
     
     consolidator = LLMSchemeConsolidator(
         model_type=model_type,
         model_name=model_name,
-        api_key=None  # Will be read from environment variables for cloud models
+        api_key=None,  # Will be read from environment variables for cloud models
+        retrieval_top_k=retrieval_top_k
     )
     
     consolidated = consolidator.consolidate_all(
         'cleaned_knowledge_base.json',
-        'cleaned_knowledge_base.json'
+        'cleaned_knowledge_base.json',
+        max_workers=max_workers
     )
     
     print("\n" + "="*80)
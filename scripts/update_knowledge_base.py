@@ -3,7 +3,7 @@
 Master script to update the entire knowledge base
 This script:
 1. Fetches all fund data
-2. Fetches all regulatory/help data
+2. Fetches all regulatory/help data (concurrently with step 1)
 3. Cleans and structures all data
 4. Updates the cleaned knowledge base
 
@@ -14,9 +14,20 @@ import sys
 import os
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # Optional: faster JSON emit
+except ImportError:
+    orjson = None
+
 # Add current directory to path
 script_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_dir)
@@ -26,15 +37,34 @@ os.chdir(script_dir)  # Change to script directory
 log_dir = Path(__file__).parent / 'logs'
 log_dir.mkdir(exist_ok=True)
 
+class _CachedTimeFormatter(logging.Formatter):
+    """Same output as logging.Formatter, but runs strftime once per second instead of per record"""
+    _cached = (None, '')
+    
+    def formatTime(self, record, datefmt=None):
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        cached_second, text = self._cached
+        if cached_second != second:
+            text = time.strftime(self.default_time_format, self.converter(second))
+            self._cached = (second, text)
+        return self.default_msec_format % (text, record.msecs)
+
+# The format uses none of these record fields - skip collecting them for every record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
 log_file = log_dir / f'update_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+log_formatter = _CachedTimeFormatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.FileHandler(log_file),
+    logging.StreamHandler(sys.stdout)
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+logging.basicConfig(level=logging.INFO, handlers=log_handlers)
 
 logger = logging.getLogger(__name__)
 
@@ -48,11 +78,46 @@ except ImportError as e:
     logger.error("Make sure all required scripts are in the same directory")
     sys.exit(1)
 
+def _dump_json(data, path):
+    """Write data as indented UTF-8 JSON (orjson when installed, same layout as json.dump(indent=2))
+    
+    Written to a temp file, fsynced, then renamed over path - a crash never leaves a truncated file.
+    """
+    if orjson is not None:
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        payload = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    
+    tmp_path = Path(path).with_suffix('.json.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def _make_http_session():
+    """One keep-alive connection pool for both fetchers (no TLS handshake per URL)
+    
+    Only connection failures are retried here - the fetchers already retry failed requests.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                          max_retries=Retry(connect=3, read=0, status=0, backoff_factor=0.3))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 class KnowledgeBaseUpdater:
     def __init__(self):
         self.start_time = datetime.now()
         self.errors = []
         self.warnings = []
+        # Shared by the concurrently running fetchers (urllib3's pool is thread-safe)
+        self.session = _make_http_session()
         
     def update_fund_data(self):
         """Update fund-specific data"""
@@ -61,7 +126,7 @@ class KnowledgeBaseUpdater:
         logger.info("="*80)
         
         try:
-            fetcher = FundDataFetcher()
+            fetcher = FundDataFetcher(session=self.session)
             fetcher.fetch_all_data()
             comprehensive_data = fetcher.compile_comprehensive_dataset()
             fetcher.save_dataset(comprehensive_data)
@@ -81,7 +146,7 @@ class KnowledgeBaseUpdater:
         logger.info("="*80)
         
         try:
-            fetcher = RegulatorySourceFetcher()
+            fetcher = RegulatorySourceFetcher(session=self.session)
             fetcher.fetch_all_regulatory_sources()
             fetcher.save_regulatory_data()
             
@@ -133,8 +198,7 @@ class KnowledgeBaseUpdater:
         
         # Save summary
         summary_file = Path(__file__).parent / 'update_summary.json'
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, indent=2, ensure_ascii=False)
+        _dump_json(summary, summary_file)
         
         logger.info("\n" + "="*80)
         logger.info("UPDATE SUMMARY")
@@ -154,11 +218,17 @@ class KnowledgeBaseUpdater:
         logger.info(f"Time: {self.start_time.strftime('%Y-%m-%d %H:%M:%S')}")
         logger.info("="*80)
         
-        results = {
-            'fund_data': self.update_fund_data(),
-            'regulatory_data': self.update_regulatory_data(),
-            'cleaning': self.clean_and_structure_data()
-        }
+        # Steps 1 and 2 are independent network-bound fetches (separate temp and output files),
+        # so run them together; cleaning needs both
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            fund_future = executor.submit(self.update_fund_data)
+            regulatory_future = executor.submit(self.update_regulatory_data)
+            results = {
+                'fund_data': fund_future.result(),
+                'regulatory_data': regulatory_future.result()
+            }
+        self.session.close()
+        results['cleaning'] = self.clean_and_structure_data()
         
         summary = self.create_update_summary()
         
@@ -0,0 +1,24 @@
+"""
+Shared pytest fixtures - one FAQAssistant (embedding model, vector store, LLM client) per session
+"""
+
+import os
+import sys
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+@pytest.fixture(scope="session")
+def assistant():
+    """FAQAssistant built once and reused by every test in the pytest run"""
+    from faq_assistant import FAQAssistant
+    model_type = os.getenv('LLM_MODEL_TYPE', 'ollama')
+    model_name = os.getenv('LLM_MODEL_NAME', 'llama3.1:8b')
+    api_key = os.getenv('GEMINI_API_KEY') if model_type == 'gemini' else None
+    return FAQAssistant(model_type=model_type, model_name=model_name, api_key=api_key)
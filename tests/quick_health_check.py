@@ -12,6 +12,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from dotenv import load_dotenv
 from faq_assistant import FAQAssistant
+from semantic_cache import maybe_wrap
 
 # Load environment variables
 load_dotenv()
@@ -95,21 +96,45 @@ QUICK_TESTS = [
     }
 ]
 
-def run_health_check():
-    """Run quick health check tests"""
+try:
+    import ahocorasick  # Optional: finds all of a test's phrases in one pass over the answer
+except ImportError:
+    ahocorasick = None
+
+# Lowercase each test's phrase lists once (answers are compared case-insensitively)
+for _test in QUICK_TESTS:
+    _test['should_contain_lc'] = tuple(phrase.lower() for phrase in _test.get('should_contain', ()))
+    _test['should_not_contain_lc'] = tuple(phrase.lower() for phrase in _test.get('should_not_contain', ()))
+    _test['automaton'] = None
+    if ahocorasick is not None and (_test['should_contain_lc'] or _test['should_not_contain_lc']):
+        _test['automaton'] = ahocorasick.Automaton()
+        for _phrase in _test['should_contain_lc'] + _test['should_not_contain_lc']:
+            _test['automaton'].add_word(_phrase, _phrase)
+        _test['automaton'].make_automaton()
+
+def found_phrases(test, answer_lower):
+    """The test's lowercased phrases that occur in the answer"""
+    if test['automaton'] is not None:
+        return {phrase for _, phrase in test['automaton'].iter(answer_lower)}
+    return {phrase for phrase in test['should_contain_lc'] + test['should_not_contain_lc'] if phrase in answer_lower}
+
+def run_health_check(assistant=None):
+    """Run quick health check tests (assistant: reuse an already-initialized FAQAssistant)"""
     print("=" * 70)
     print("MF CHATBOT - QUICK HEALTH CHECK")
     print("=" * 70)
     print()
     
     # Initialize assistant
-    try:
-        print("🔧 Initializing assistant...")
-        assistant = FAQAssistant()
-        print("✅ Assistant initialized successfully\n")
-    except Exception as e:
-        print(f"❌ Failed to initialize assistant: {e}")
-        return
+    if assistant is None:
+        try:
+            print("🔧 Initializing assistant...")
+            assistant = FAQAssistant()
+            print("✅ Assistant initialized successfully\n")
+        except Exception as e:
+            print(f"❌ Failed to initialize assistant: {e}")
+            return
+    assistant = maybe_wrap(assistant, namespace=f"{assistant.model_type}_{assistant.model_name}")
     
     # Run tests
     passed = 0
@@ -136,13 +161,12 @@ def run_health_check():
                 })
                 continue
             
-            # Check "should contain" conditions
-            if "should_contain" in test:
-                missing = []
-                for phrase in test['should_contain']:
-                    # Check if any variant of the phrase is present (case-insensitive)
-                    if not any(variant.lower() in answer.lower() for variant in [phrase]):
-                        missing.append(phrase)
+            found_lc = found_phrases(test, answer.lower())
+            
+            # Check "should contain" conditions (case-insensitive)
+            if test['should_contain_lc']:
+                missing = [phrase for phrase, phrase_lc in zip(test['should_contain'], test['should_contain_lc'])
+                           if phrase_lc not in found_lc]
                 
                 if missing:
                     print(f"⚠️  MISSING: {', '.join(missing)}")
@@ -157,11 +181,9 @@ def run_health_check():
                     continue
             
             # Check "should not contain" conditions
-            if "should_not_contain" in test:
-                found = []
-                for phrase in test['should_not_contain']:
-                    if phrase.lower() in answer.lower():
-                        found.append(phrase)
+            if test['should_not_contain_lc']:
+                found = [phrase for phrase, phrase_lc in zip(test['should_not_contain'], test['should_not_contain_lc'])
+                         if phrase_lc in found_lc]
                 
                 if found:
                     print(f"⚠️  UNEXPECTED: Found {', '.join(found)}")
@@ -194,6 +216,10 @@ def run_health_check():
                 "reason": str(e)
             })
     
+    if hasattr(assistant, 'save'):
+        assistant.save()
+        print(f"Semantic cache: {assistant.hits} hits, {assistant.misses} LLM calls\n")
+    
     # Summary
     print("=" * 70)
     print("SUMMARY")
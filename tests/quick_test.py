@@ -41,7 +41,8 @@ def quick_test():
     print("\n2. Initializing RAG system...")
     try:
         rag = RAGSystem()
-        rag.create_vector_store(force_recreate=False)
+        if not rag.load_existing():
+            rag.create_vector_store(force_recreate=False)
         print("   ✓ RAG system initialized")
     except Exception as e:
         print(f"   ❌ Error: {e}")
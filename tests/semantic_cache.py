@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Semantic cache for FAQAssistant.process_query in the test scripts
+Repeated runs and paraphrased queries reuse a stored answer instead of calling the LLM.
+
+Opt-in (TEST_SEMANTIC_CACHE=true) because a hit skips the code under test - use it while
+iterating on prompts or output checks, not for a final health check. A hit also needs the same
+fund (or none) named in both queries - "expense ratio of Large Cap" and "... of Flexi Cap"
+embed well above any useful threshold.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+
+DEFAULT_THRESHOLD = '0.97'
+
+class SemanticCache:
+    """Wraps an assistant; process_query returns a cached (answer, source) when a previous
+    query about the same fund embeds with cosine similarity >= threshold (first turn of a chat only)
+
+    Queries are embedded with the assistant's own RAG encoder (no second model in memory).
+    """
+
+    def __init__(self, assistant, namespace: str = 'default', threshold: float = None,
+                 cache_dir: str = CACHE_DIR):
+        self.assistant = assistant
+        self.threshold = threshold if threshold is not None else float(
+            os.getenv('TEST_SEMANTIC_CACHE_THRESHOLD', DEFAULT_THRESHOLD))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # One file pair per backend/model so answers from different LLMs never mix
+        safe_namespace = "".join(c if c.isalnum() or c in '-_.' else '_' for c in namespace)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, f'semantic_cache_{safe_namespace}.npy')
+        self.payloads_path = os.path.join(cache_dir, f'semantic_cache_{safe_namespace}.json')
+
+        self.payloads = []
+        vectors = np.zeros((0, 384), dtype=np.float32)
+        if os.path.exists(self.vectors_path) and os.path.exists(self.payloads_path):
+            vectors = np.load(self.vectors_path).astype(np.float32)
+            with open(self.payloads_path, 'r', encoding='utf-8') as f:
+                self.payloads = json.load(f)
+            # Entries written before fund-keyed lookups can't be trusted across funds
+            if len(self.payloads) != len(vectors) or any('fund' not in p for p in self.payloads):
+                vectors, self.payloads = np.zeros((0, 384), dtype=np.float32), []
+
+        # Inner product over normalized vectors == cosine similarity
+        self.vectors = vectors
+        self.index = None
+        if faiss is not None:
+            self.index = faiss.IndexFlatIP(vectors.shape[1])
+            if len(vectors):
+                self.index.add(vectors)
+
+    def embed(self, query: str):
+        """Normalized query embedding from the RAG system's (shared, per-process) encoder"""
+        return self.assistant.rag_system._encode_queries([query.strip().lower()]).astype(np.float32)
+
+    def fund(self, query: str):
+        """fund_tag named in the query (None if none) - part of the cache key"""
+        return self.assistant.rag_system._detect_fund_filter(query)
+
+    def lookup(self, embedding, fund):
+        """Return the most similar cached payload for the same fund at or above the threshold, or None"""
+        if not self.payloads:
+            return None
+        if self.index is not None:
+            scores, ids = self.index.search(embedding, len(self.payloads))
+            ranked = zip(scores[0], ids[0])
+        else:
+            similarities = self.vectors @ embedding[0]
+            order = np.argsort(-similarities)
+            ranked = zip(similarities[order], order)
+        for score, best in ranked:
+            if score < self.threshold:
+                return None
+            if self.payloads[int(best)].get('fund') == fund:
+                return self.payloads[int(best)]
+        return None
+
+    def add(self, embedding, query: str, answer: str, source):
+        self.payloads.append({'query': query, 'fund': self.fund(query), 'answer': answer, 'source': source})
+        self.vectors = np.vstack([self.vectors, embedding])
+        if self.index is not None:
+            self.index.add(embedding)
+
+    def process_query(self, query: str, chat_history=None):
+        """Same signature and (answer, source) result as FAQAssistant.process_query"""
+        if chat_history:
+            return self.assistant.process_query(query, chat_history)
+
+        embedding = self.embed(query)
+        with self._lock:
+            cached = self.lookup(embedding, self.fund(query))
+            if cached is not None:
+                self.hits += 1
+                return cached['answer'], cached['source']
+            self.misses += 1
+
+        answer, source = self.assistant.process_query(query, [])
+        with self._lock:
+            self.add(embedding, query, answer, source)
+        return answer, source
+
+    def process_queries(self, queries):
+        """Same result as FAQAssistant.process_queries; only the cache misses are sent on, as one batch"""
+        embeddings = [self.embed(query) for query in queries]
+        answers = [None] * len(queries)
+        with self._lock:
+            for i, embedding in enumerate(embeddings):
+                cached = self.lookup(embedding, self.fund(queries[i]))
+                if cached is not None:
+                    self.hits += 1
+                    answers[i] = (cached['answer'], cached['source'])
+                else:
+                    self.misses += 1
+
+        pending = [i for i, answered in enumerate(answers) if answered is None]
+        if pending:
+            fresh = self.assistant.process_queries([queries[i] for i in pending])
+            with self._lock:
+                for i, (answer, source) in zip(pending, fresh):
+                    answers[i] = (answer, source)
+                    self.add(embeddings[i], queries[i], answer, source)
+        return answers
+
+    def save(self):
+        """Persist vectors + payloads for the next run"""
+        with self._lock:
+            np.save(self.vectors_path, self.vectors)
+            with open(self.payloads_path, 'w', encoding='utf-8') as f:
+                json.dump(self.payloads, f, ensure_ascii=False)
+
+    def __getattr__(self, name):
+        # Everything else (classify_query_type, handlers, ...) goes to the wrapped assistant
+        if name == 'assistant':
+            raise AttributeError(name)
+        return getattr(self.assistant, name)
+
+
+def maybe_wrap(assistant, namespace: str = 'default'):
+    """Wrap the assistant in a SemanticCache when TEST_SEMANTIC_CACHE is enabled"""
+    if os.getenv('TEST_SEMANTIC_CACHE', 'false').lower() in ('1', 'true', 'yes'):
+        print(f"✓ Semantic cache enabled (threshold {os.getenv('TEST_SEMANTIC_CACHE_THRESHOLD', DEFAULT_THRESHOLD)})")
+        return SemanticCache(assistant, namespace=namespace)
+    return assistant
@@ -3,18 +3,19 @@
 Quick test for out-of-context detection
 """
 
-from faq_assistant import FAQAssistant
+import os
+import sys
 
 # Add parent directory to path to import modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from faq_assistant import FAQAssistant
+
 
-def test_out_of_context():
-    """Test out-of-context query detection"""
+def test_out_of_context(assistant):
+    """Test out-of-context query detection (assistant: session fixture from conftest.py)"""
     print("Testing out-of-context detection...\n")
     
-    assistant = FAQAssistant()
-    
     test_cases = [
         ("do you cook", "out_of_context"),
         ("what's the weather", "out_of_context"),
@@ -29,9 +30,10 @@ def test_out_of_context():
     passed = 0
     failed = 0
     
-    for query, expected_type in test_cases:
-        actual_type = assistant.classify_query_type(query)
-        
+    # Classify all queries together (one LLM call for the ones the rules can't settle)
+    actual_types = assistant.classify_query_types([query for query, _ in test_cases])
+    
+    for (query, expected_type), actual_type in zip(test_cases, actual_types):
         if actual_type == expected_type:
             print(f"✅ PASS: '{query}' → {actual_type}")
             passed += 1
@@ -50,6 +52,24 @@ def test_out_of_context():
         print("🎉 All tests passed!")
         return 0
 
+def test_llm_classify_queries_parsing():
+    """Batched classification maps numbered response lines back to their queries (no LLM needed)"""
+    assistant = FAQAssistant.__new__(FAQAssistant)
+    prompts = []
+    
+    def fake_llm(prompt, max_tokens=200, temperature=0.3, system_prompt=None):
+        prompts.append(prompt)
+        # Out of order, mixed formatting, one invalid category and one missing line
+        return '2) "advice"\n1. out_of_context\n4: banana\nnote: done'
+    
+    assistant._call_llm = fake_llm
+    queries = ["tell me a joke", "should i buy elss", "what is nav", "expense ratio of flexi cap"]
+    
+    assert assistant.llm_classify_queries(queries) == ['out_of_context', 'advice', 'factual', 'factual']
+    assert len(prompts) == 1
+    assert '1. "tell me a joke"' in prompts[0] and '4. "expense ratio of flexi cap"' in prompts[0]
+
 if __name__ == "__main__":
-    exit(test_out_of_context())
+    test_llm_classify_queries_parsing()
+    exit(test_out_of_context(FAQAssistant()))
 
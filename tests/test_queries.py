@@ -4,15 +4,25 @@ Test 20 queries across different categories
 Tests: fund-related, knowledge, help, miscellaneous, advice, greetings
 """
 
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Add parent directory to path to import modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import os
-import sys
 from dotenv import load_dotenv
-from faq_assistant import FAQAssistant
-from rag_system import RAGSystem
+from faq_assistant import FAQAssistant, OUT_OF_CONTEXT_RE
+from semantic_cache import maybe_wrap
+
+try:
+    import orjson  # Optional: faster results serialisation
+except ImportError:
+    orjson = None
 
 # Load environment variables
 load_dotenv()
@@ -55,20 +65,84 @@ test_queries = {
     ]
 }
 
-def test_query(assistant, query, category):
-    """Test a single query and return the result"""
-    print(f"\n{'='*80}")
-    print(f"Category: {category}")
-    print(f"Query: {query}")
-    print(f"{'='*80}")
+_print_lock = threading.Lock()
+
+class RateLimiter:
+    """Spaces calls at least 60/rpm seconds apart across threads (avoids Gemini 429s)"""
+    
+    def __init__(self, rpm: int):
+        self.interval = 60.0 / rpm
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+    
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+def pace_llm_calls(assistant, rate_limiter):
+    """Charge rate_limiter once per underlying LLM request - one query can make several
+    (classification, refinement, answer) and a batch makes at least one per query"""
+    inner = getattr(assistant, 'assistant', assistant)  # unwrap SemanticCache
+    call_llm = inner._call_llm
+    
+    def paced_call_llm(*args, **kwargs):
+        rate_limiter.wait()
+        return call_llm(*args, **kwargs)
+    
+    inner._call_llm = paced_call_llm
+
+# Categories whose queries are classified together (one LLM classification call per batch); fund-related
+# queries stay one per call since each needs its own retrieval context
+BATCHED_CATEGORIES = {
+    "Knowledge (General MF)",
+    "Miscellaneous (Out of Context)",
+    "Advice (Should be Refused)",
+    "Greetings",
+}
+
+def batched_process_query(assistant, queries, batch_size=6):
+    """Answer queries batch_size at a time through FAQAssistant.process_queries; returns [(answer, source)]"""
+    answers = []
+    for start in range(0, len(queries), batch_size):
+        answers.extend(assistant.process_queries(queries[start:start + batch_size]))
+    return answers
+
+def fast_answer(assistant, query):
+    """--fast-mode: the canned (answer, source) for queries the rules settle without any LLM call
+    (greeting, coverage, advice, or an out-of-context pattern match); None for everything else"""
+    if assistant.is_greeting(query):
+        return assistant.handle_greeting(), None
+    if assistant.is_coverage_query(query):
+        return assistant.handle_coverage_query(), None
+    if assistant.is_advice_query(query):
+        return assistant.handle_advice_query(), None
+    if OUT_OF_CONTEXT_RE.search(query):
+        return assistant.handle_out_of_context(), None
+    return None
+
+def test_query(assistant, query, category, label="", answered=None):
+    """Test a single query and return the result (output is printed as one block)
+    
+    answered: (answer, source) already produced by a batched call
+    """
+    lines = [f"\n{label}{'='*80}", f"Category: {category}", f"Query: {query}", '='*80]
     
     try:
-        # Get answer using the assistant
-        answer, source = assistant.process_query(query, [])
+        if answered is not None:
+            answer, source = answered
+        else:
+            # Get answer using the assistant
+            answer, source = assistant.process_query(query, [])
         
-        print(f"Answer: {answer}")
+        lines.append(f"Answer: {answer}")
         if source:
-            print(f"Source: {source}")
+            lines.append(f"Source: {source}")
+        with _print_lock:
+            print("\n".join(lines))
         return {
             'query': query,
             'category': category,
@@ -77,9 +151,11 @@ def test_query(assistant, query, category):
             'status': 'success'
         }
     except Exception as e:
-        print(f"Error: {e}")
         import traceback
-        traceback.print_exc()
+        lines.append(f"Error: {e}")
+        lines.append(traceback.format_exc())
+        with _print_lock:
+            print("\n".join(lines))
         return {
             'query': query,
             'category': category,
@@ -87,25 +163,34 @@ def test_query(assistant, query, category):
             'status': 'error'
         }
 
-def main():
+def main(assistant=None, fast_mode=False):
+    """Run every test query (assistant: reuse an already-initialized FAQAssistant)
+    
+    fast_mode: answer greeting/coverage/advice/out-of-context queries with the canned responses
+    directly, skipping the LLM; the default slow path exercises the real model for every query.
+    """
     print("="*80)
     print("TESTING 20 QUERIES ACROSS ALL CATEGORIES")
     print("="*80)
     
     # Initialize assistant
     print("\nInitializing FAQ Assistant...")
+    # Use Ollama by default (no rate limits)
+    model_type = os.getenv('LLM_MODEL_TYPE', 'ollama')
+    model_name = os.getenv('LLM_MODEL_NAME', 'llama3.1:8b')
     try:
-        # Use Ollama by default (no rate limits)
-        model_type = os.getenv('LLM_MODEL_TYPE', 'ollama')
-        model_name = os.getenv('LLM_MODEL_NAME', 'llama3.1:8b')
-        api_key = os.getenv('GEMINI_API_KEY') if model_type == 'gemini' else None
-        
-        assistant = FAQAssistant(model_type=model_type, model_name=model_name, api_key=api_key)
+        if assistant is None:
+            api_key = os.getenv('GEMINI_API_KEY') if model_type == 'gemini' else None
+            assistant = FAQAssistant(model_type=model_type, model_name=model_name, api_key=api_key)
+        assistant = maybe_wrap(assistant, namespace=f"{model_type}_{model_name}")
         print("✓ FAQ Assistant initialized")
         
-        # Initialize RAG system
-        rag = RAGSystem()
-        rag.create_vector_store(force_recreate=False)
+        # Initialize the assistant's own RAG system (no second copy of the store/model)
+        rag = assistant.rag_system
+        if not rag.collection and not rag.load_existing():
+            rag.create_vector_store(force_recreate=False)
+        # Load the encoder before the worker threads start, so they don't race to load it
+        rag.embedding_model
         print("✓ RAG system initialized\n")
     except Exception as e:
         print(f"❌ Error initializing: {e}")
@@ -113,34 +198,64 @@ def main():
         traceback.print_exc()
         return
     
-    # Test all queries
-    results = []
-    total_queries = sum(len(queries) for queries in test_queries.values())
-    current = 0
+    # Test all queries concurrently - each call waits on the LLM endpoint, not the CPU
+    all_queries = [(category, query) for category, queries in test_queries.items() for query in queries]
+    total_queries = len(all_queries)
+    max_workers = int(os.getenv('TEST_QUERY_WORKERS', '16'))
+    if model_type == 'gemini':
+        pace_llm_calls(assistant, RateLimiter(int(os.getenv('GEMINI_RPM', '60'))))
+    batch_size = max(int(os.getenv('TEST_QUERY_BATCH_SIZE', '6')), 1)
+    
+    def run(indices):
+        """Answer a batch of queries in one call (or a single query), recording each as test_query"""
+        answers = [fast_answer(assistant, all_queries[i][1]) if fast_mode else None for i in indices]
+        pending = [n for n, answered in enumerate(answers) if answered is None]
+        if len(pending) > 1:
+            try:
+                batch_answers = batched_process_query(assistant, [all_queries[indices[n]][1] for n in pending],
+                                                      batch_size)
+                for n, answered in zip(pending, batch_answers):
+                    answers[n] = answered
+            except Exception:
+                pass  # test_query retries each query on its own so failures are reported per query
+        return [(i, test_query(assistant, all_queries[i][1], all_queries[i][0],
+                               f"[{i + 1}/{total_queries}] ", answered))
+                for i, answered in zip(indices, answers)]
+    
+    batched = [i for i, (category, _) in enumerate(all_queries) if category in BATCHED_CATEGORIES]
+    jobs = [batched[start:start + batch_size] for start in range(0, len(batched), batch_size)]
+    jobs += [[i] for i, (category, _) in enumerate(all_queries) if category not in BATCHED_CATEGORIES]
+    
+    # Each result is appended to a JSONL file as soon as it completes (nothing is lost if the
+    # run dies midway) and counted into the summary inline - no full results list is kept
+    by_category = {category: {'total': 0, 'success': 0, 'error': 0} for category in test_queries}
+    results_file = 'test_query_results.jsonl'
+    with open(results_file, 'w', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in as_completed([executor.submit(run, indices) for indices in jobs]):
+            for i, result in future.result():
+                record = {'index': i, **result}
+                if orjson is not None:
+                    out.write(orjson.dumps(record).decode('utf-8') + "\n")
+                else:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                
+                stats = by_category[result['category']]
+                stats['total'] += 1
+                if result['status'] == 'success':
+                    stats['success'] += 1
+                else:
+                    stats['error'] += 1
     
-    for category, queries in test_queries.items():
-        for query in queries:
-            current += 1
-            print(f"\n[{current}/{total_queries}] ", end="")
-            result = test_query(assistant, query, category)
-            results.append(result)
+    if hasattr(assistant, 'save'):
+        assistant.save()
+        print(f"\n✓ Semantic cache: {assistant.hits} hits, {assistant.misses} LLM calls")
     
     # Summary
     print("\n" + "="*80)
     print("TEST SUMMARY")
     print("="*80)
     
-    by_category = {}
-    for result in results:
-        category = result['category']
-        if category not in by_category:
-            by_category[category] = {'total': 0, 'success': 0, 'error': 0}
-        by_category[category]['total'] += 1
-        if result['status'] == 'success':
-            by_category[category]['success'] += 1
-        else:
-            by_category[category]['error'] += 1
-    
     for category, stats in by_category.items():
         print(f"\n{category}:")
         print(f"  Total: {stats['total']}")
@@ -152,13 +267,12 @@ def main():
     print(f"Successful: {sum(s['success'] for s in by_category.values())}")
     print(f"Errors: {sum(s['error'] for s in by_category.values())}")
     print("="*80)
-    
-    # Save results to file
-    import json
-    with open('test_query_results.json', 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
-    print(f"\n✓ Results saved to test_query_results.json")
+    print(f"\n✓ Results saved to {results_file} (one JSON object per line, 'index' = query order)")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fast-mode', action='store_true',
+                        help='Answer greeting/advice/out-of-context queries from rules, without the LLM')
+    args = parser.parse_args()
+    main(fast_mode=args.fast_mode)
 